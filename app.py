@@ -1,16 +1,28 @@
-from dash import Dash, html, Input, Output, callback, State, dcc
-from flask import g
+import os
+import threading
+import time
+
+# Start of the worker startup, measured until the layout is built
+STARTUP_START = time.perf_counter()
+
+from dash import Dash, html, Input, Output, callback, State, dcc, DiskcacheManager
+from flask import g, Response
 import dash
 import dash_bootstrap_components as dbc
 import schedule
-import time
-from backend.library_update import library_update
+from backend.cache import get_cache
+from backend.llm_client import llm_client
+from backend.tracing import registry
+
+# Long-running callbacks run as background jobs in separate processes, so they do not block the web workers
+background_callback_manager = DiskcacheManager(get_cache("callbacks"))
 
 app = Dash(
     __name__,
     external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],
     use_pages=True,
     suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager,
 )  # unter external Stylesheet kann ein eigenes css-File hinterlegt werden
 server = app.server
 
@@ -44,17 +56,49 @@ app.layout = dbc.Container(
     ]
 )
 
+# Startup time of the worker, i.e. imports, page registration and layout
+registry.observe("datajoiner_startup_seconds", time.perf_counter() - STARTUP_START)
+
 ###############################################################################################
 # CALLBACKS
 ###############################################################################################
 # for multiple callbacks referring to the same entity etx. all Callbacks can be migrated to this section
 
+###############################################################################################
+# LLM
+###############################################################################################
+# Loads the model into Ollama in the background, so the first search does not wait for it
+
+if os.environ.get("DATAJOINER_LLM_WARMUP", "1") != "0":
+    threading.Thread(target=llm_client.warmup, daemon=True).start()
+
+###############################################################################################
+# METRICS
+###############################################################################################
+# Exposes the stage latencies, cache counters and LLM queue of the joiner pipeline for Prometheus
+
+
+@server.route("/metrics")
+def metrics():
+    # the LLM gauges are derived from the live queue entries on every scrape
+    llm_client.report_metrics()
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 ###############################################################################################
 # LIBRARY UPDATE
 ###############################################################################################
 # Updates the catalog
 
-schedule.every().day.at("10:30").do(library_update)
+
+def update_library():
+    # imported on first use, the catalogue update depends on packages the web workers do not need
+    from backend.library_update import library_update
+
+    library_update()
+
+
+schedule.every().day.at("10:30").do(update_library)
 
 
 def run_scheduler():
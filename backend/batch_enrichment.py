@@ -0,0 +1,433 @@
+"""
+Enriches all user datasets in a directory with datasets from the catalogue, without the web application.
+
+The catalogue is filtered, the retriever finds the matching catalogue datasets for every user dataset, and the
+datasets are joined like in the application, including the dataset store, the join cache and out-of-core joins. The
+files are processed by a pool of workers, every catalogue dataset is downloaded at most once per run, and the results
+are written as Parquet or CSV files together with a JSON report of the timings and match rates.
+
+Run from the root of the repository:
+    python -m backend.batch_enrichment input_dir output_dir --tag "Bevölkerung und Gesellschaft" --workers 8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import Future, ThreadPoolExecutor
+import backend.general_methods as gm
+from backend.duckdb_join import LARGE_FILE_BYTES, ParquetJoinResult, csv_to_parquet
+from backend.enrichment import download_candidate, enrich_dataset, read_stored_candidate
+
+# File types of the user datasets that are processed
+INPUT_EXTENSIONS = (".csv", ".parquet")
+
+# Name of the report written to the output directory
+REPORT_NAME = "report.json"
+
+
+def read_user_dataset(path: str) -> pd.DataFrame | ParquetJoinResult:
+    """
+    Reads a user dataset from a CSV file in the format of the upload (semicolon separated, decimal comma,
+    ISO-8859-1) or from a Parquet file.
+
+    Files too large for memory are not read: Parquet files are used as they are, CSV files are converted to a
+    Parquet file with DuckDB, and the dataset is joined out-of-core.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the file.
+
+    Returns:
+    -------
+    pd.DataFrame or ParquetJoinResult
+        The user dataset.
+    """
+    large = os.path.getsize(path) > LARGE_FILE_BYTES
+    if path.endswith(".parquet"):
+        return ParquetJoinResult(path) if large else pd.read_parquet(path)
+    if large:
+        return csv_to_parquet(path)
+    return pd.read_csv(
+        path, delimiter=";", decimal=",", parse_dates=True, encoding="iso-8859-1"
+    )
+
+
+class DatasetDownloads:
+    """
+    A class to download every catalogue dataset at most once per run, also if several files need it at the same time.
+
+    Datasets stored locally by a previous download are only read where they match the keys of a file (semi-join).
+    Datasets that could not be stored (e.g. too large for memory or without HTTP validators) are downloaded once
+    and shared by all files.
+
+    Attributes:
+    ----------
+    futures : dict
+        The downloads of the catalogue datasets, keyed by their link.
+    seconds : dict
+        The duration of every download in seconds, keyed by the link of the dataset.
+
+    Methods:
+    -------
+    get(link: str, validators: dict, key_column: str, keys: pd.Series, col_and_typ: dict = None) -> tuple
+        Retrieves a catalogue dataset like fetch_candidate, downloading it on first use.
+    """
+
+    def __init__(self):
+        """
+        Initializes the DatasetDownloads without any datasets.
+        """
+        self.futures = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        link: str,
+        validators: dict,
+        key_column: str,
+        keys: pd.Series,
+        col_and_typ: dict = None,
+    ) -> tuple:
+        """
+        Retrieves the rows of a catalogue dataset needed for a left join on the given keys, like fetch_candidate.
+        Other workers needing the same dataset wait for the download instead of starting their own.
+
+        Parameters:
+        ----------
+        link : str
+            The link to the CSV file.
+        validators : dict
+            The HTTP validators of the CSV file.
+        key_column : str
+            The join column of the catalogue dataset.
+        keys : pd.Series
+            The keys of the user dataset.
+        col_and_typ : dict, optional
+            The column types of the dataset from the catalogue (default is None).
+
+        Returns:
+        -------
+        tuple
+            The dataset (or the rows of it matching the keys, or a ParquetJoinResult) and its content hash.
+        """
+        stored = read_stored_candidate(link, validators, key_column, keys)
+        if stored is not None:
+            return stored
+
+        with self._lock:
+            future = self.futures.get(link)
+            download = future is None
+            if download:
+                future = self.futures[link] = Future()
+
+        if download:
+            start = time.perf_counter()
+            try:
+                future.set_result(
+                    download_candidate(link, validators, key_column, col_and_typ)
+                )
+            except Exception as e:
+                future.set_exception(e)
+            self.seconds[link] = round(time.perf_counter() - start, 4)
+
+        return future.result()
+
+
+def write_result(combined_df, path: str, output_format: str = "parquet") -> str:
+    """
+    Writes a combined dataset to a Parquet or CSV file.
+
+    Parameters:
+    ----------
+    combined_df : pd.DataFrame or ParquetJoinResult
+        The combined dataset.
+    path : str
+        The path of the file without the extension of the output format.
+    output_format : str, optional
+        "parquet" or "csv" (default is "parquet").
+
+    Returns:
+    -------
+    str
+        The path of the written file.
+    """
+    path = f"{path}.{output_format}"
+    if isinstance(combined_df, ParquetJoinResult):
+        # results of out-of-core joins are already stored in a Parquet file, which may be shared with the join cache
+        if output_format == "parquet":
+            shutil.copyfile(combined_df.path, path)
+        else:
+            combined_df.to_csv(path)
+    elif output_format == "parquet":
+        combined_df.to_parquet(path, index=False)
+    else:
+        combined_df.to_csv(path, index=False)
+    return path
+
+
+def enrich_file(
+    path: str,
+    catalog: pd.DataFrame,
+    output_dir: str,
+    downloads: DatasetDownloads,
+    max_datasets: int = 3,
+    solutions: list = None,
+    output_format: str = "parquet",
+) -> dict:
+    """
+    Enriches one user dataset with the matching catalogue datasets and writes the result.
+
+    The datasets are joined with enrich_dataset like in the application, so join results of unchanged inputs are
+    taken from the join cache. The result is named after the whole file name of the user dataset (e.g.
+    "a.csv.parquet"), so files differing only in their extension do not overwrite each other's result.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the user dataset.
+    catalog : pd.DataFrame
+        The (filtered) data catalogue.
+    output_dir : str
+        The directory the result is written to.
+    downloads : DatasetDownloads
+        The catalogue datasets downloaded in this run.
+    max_datasets : int, optional
+        The maximum number of catalogue datasets joined to the user dataset (default is 3).
+    solutions : list, optional
+        Fixed join definitions as returned by the retriever, used instead of the retriever (default is None).
+    output_format : str, optional
+        "parquet" or "csv" (default is "parquet").
+
+    Returns:
+    -------
+    dict
+        The report of the file: the number of rows, the joined datasets with their match rates, the share of rows
+        matched by at least one dataset, the output file, the duration of every step and the error, if any. Match
+        rates are missing if the result was taken from the join cache.
+    """
+    report = {"file": os.path.basename(path), "seconds": {}}
+    seconds = report["seconds"]
+
+    try:
+        start = time.perf_counter()
+        user_dataset = read_user_dataset(path)
+        seconds["read"] = round(time.perf_counter() - start, 4)
+        report["rows"] = len(user_dataset)
+
+        start = time.perf_counter()
+        if solutions is None:
+            # imported on first use, the retriever is not needed if the join definitions are given
+            from backend.llm import mistral_retriever_multi
+
+            file_solutions = mistral_retriever_multi(catalog, user_dataset, max_datasets)
+        else:
+            file_solutions = solutions
+        seconds["retrieve"] = round(time.perf_counter() - start, 4)
+
+        # only join definitions referring to the catalogue and to columns of the file are used
+        file_solutions = [
+            solution
+            for solution in file_solutions
+            if solution["dataset_id"] in catalog.index
+            and solution["col_name_user"] in user_dataset.columns
+        ]
+        if not file_solutions:
+            report["error"] = "No matching dataset found"
+            return report
+
+        report["datasets"] = []
+        entries = {}
+        for solution in file_solutions:
+            dataset_id = solution["dataset_id"]
+            entry = {"dataset_id": dataset_id, "title": catalog.loc[dataset_id, "Title"]}
+            report["datasets"].append(entry)
+            entries.setdefault(
+                (catalog.loc[dataset_id, "CSV"], solution["col_name_catalog"]), []
+            ).append(entry)
+
+        matches = []
+
+        def fetch(link, validators, key_column, keys, col_and_typ=None):
+            # retrieves a dataset once per run and records its match rate in the report
+            try:
+                candidate_df, content_hash = downloads.get(
+                    link, validators, key_column, keys, col_and_typ
+                )
+                if key_column not in candidate_df.columns:
+                    raise KeyError(f"Column {key_column} not found")
+            except Exception as e:
+                for entry in entries[(link, key_column)]:
+                    entry["error"] = f"Download failed: {e}"
+                raise
+
+            # only the join columns are read from datasets stored in Parquet files
+            match = keys.isin(gm.get_column(candidate_df, key_column)).to_numpy()
+            for entry in entries[(link, key_column)]:
+                entry["match_rate"] = round(float(match.mean()), 4) if len(match) else 0.0
+            matches.append(match)
+            return candidate_df, content_hash
+
+        start = time.perf_counter()
+        combined_df, added_columns = enrich_dataset(
+            user_dataset, file_solutions, catalog, fetch=fetch
+        )
+        seconds["enrich"] = round(time.perf_counter() - start, 4)
+        report["added_columns"] = added_columns
+        report["cached"] = not matches and not any(
+            "error" in entry for entry in report["datasets"]
+        )
+        if matches:
+            matched = np.logical_or.reduce(matches)
+            report["match_rate"] = round(float(matched.mean()), 4) if len(matched) else 0.0
+
+        start = time.perf_counter()
+        report["output"] = write_result(
+            combined_df,
+            os.path.join(output_dir, os.path.basename(path)),
+            output_format,
+        )
+        seconds["write"] = round(time.perf_counter() - start, 4)
+        report["output_rows"] = len(combined_df)
+
+    except Exception as e:
+        report["error"] = str(e)
+
+    return report
+
+
+def enrich_directory(
+    input_dir: str,
+    output_dir: str,
+    tag: str = None,
+    keys: list = None,
+    workers: int = 4,
+    max_datasets: int = 3,
+    solutions: list = None,
+    output_format: str = "parquet",
+    catalog_path: str = gm.CATALOG_PATH,
+) -> dict:
+    """
+    Enriches all user datasets (CSV and Parquet files) in a directory and writes the results and a JSON report to
+    the output directory.
+
+    Parameters:
+    ----------
+    input_dir : str
+        The directory with the user datasets.
+    output_dir : str
+        The directory the results and the report are written to.
+    tag : str, optional
+        The tag the catalogue datasets must have (default is None, no filtering by tag).
+    keys : list, optional
+        The keywords of which the catalogue datasets must have at least one (default is None).
+    workers : int, optional
+        The number of files processed in parallel (default is 4).
+    max_datasets : int, optional
+        The maximum number of catalogue datasets joined to every user dataset (default is 3).
+    solutions : list, optional
+        Fixed join definitions as returned by the retriever, used for all files instead of the retriever
+        (default is None).
+    output_format : str, optional
+        "parquet" or "csv" (default is "parquet").
+    catalog_path : str, optional
+        The path of the data catalogue (default is CATALOG_PATH).
+
+    Returns:
+    -------
+    dict
+        The report of the run with the report of every file.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    if catalog_path == gm.CATALOG_PATH:
+        catalog = gm.load_filtered_catalog(tag, keys)
+    else:
+        catalog = gm.filter_catalog(gm.load_catalog(catalog_path), tag, keys)
+
+    paths = sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(INPUT_EXTENSIONS)
+    )
+
+    downloads = DatasetDownloads()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        files = list(
+            executor.map(
+                lambda path: enrich_file(
+                    path,
+                    catalog,
+                    output_dir,
+                    downloads,
+                    max_datasets,
+                    solutions,
+                    output_format,
+                ),
+                paths,
+            )
+        )
+
+    report = {
+        "files": files,
+        "num_files": len(files),
+        "num_failed": sum("error" in file for file in files),
+        "catalog_entries": len(catalog),
+        "downloads": downloads.seconds,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+    with open(os.path.join(output_dir, REPORT_NAME), "w") as file:
+        json.dump(report, file, indent=4, ensure_ascii=False, default=str)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Enriches all user datasets in a directory with datasets from the catalogue"
+    )
+    parser.add_argument("input_dir", help="directory with the user datasets (CSV or Parquet)")
+    parser.add_argument("output_dir", help="directory the results and the report are written to")
+    parser.add_argument("--tag", help="only use catalogue datasets with this tag")
+    parser.add_argument("--keys", nargs="+", help="only use catalogue datasets with one of these keywords")
+    parser.add_argument("--workers", type=int, default=4, help="number of files processed in parallel")
+    parser.add_argument("--max-datasets", type=int, default=3)
+    parser.add_argument(
+        "--solutions",
+        help="JSON file with fixed join definitions used instead of the LLM, "
+        'e.g. [{"dataset_id": 4, "col_name_user": "Tatb-Nr.", "col_name_catalog": "Tatb-Nr."}]',
+    )
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--catalog", default=gm.CATALOG_PATH, help="path of the data catalogue")
+    args = parser.parse_args()
+
+    solutions = None
+    if args.solutions:
+        with open(args.solutions) as file:
+            solutions = json.load(file)
+
+    report = enrich_directory(
+        args.input_dir,
+        args.output_dir,
+        args.tag,
+        args.keys,
+        args.workers,
+        args.max_datasets,
+        solutions,
+        args.format,
+        args.catalog,
+    )
+    print(
+        f"{report['num_files']} files processed, {report['num_failed']} failed, "
+        f"{len(report['downloads'])} datasets downloaded in {report['seconds']:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
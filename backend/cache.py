@@ -0,0 +1,27 @@
+import os
+import diskcache
+
+# Directory of the caches shared by the web workers and the background jobs
+CACHE_DIR = os.environ.get("DATAJOINER_CACHE_DIR", "cache")
+
+
+def get_cache(name: str, **settings) -> diskcache.Cache:
+    """
+    Returns a disk cache in a subdirectory of CACHE_DIR.
+
+    Disk caches can be opened by several processes at the same time, they are used to share state between the
+    web workers and the background jobs of the long-running callbacks.
+
+    Parameters:
+    ----------
+    name : str
+        The name of the subdirectory.
+    **settings
+        Settings of the cache, e.g. size_limit.
+
+    Returns:
+    -------
+    diskcache.Cache
+        The disk cache.
+    """
+    return diskcache.Cache(os.path.join(CACHE_DIR, name), **settings)
@@ -0,0 +1,285 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+
+# Directory of the catalogue snapshots, every version is a subdirectory
+SNAPSHOT_DIR = os.environ.get("DATAJOINER_SNAPSHOT_DIR", "Lib/snapshots")
+
+# Name of the file in SNAPSHOT_DIR with the current version
+CURRENT_NAME = "CURRENT"
+
+# Number of versions kept, older versions are removed when a new one is published
+KEEP_VERSIONS = 2
+
+# Columns with lists or dictionaries, they are stored as JSON text
+JSON_COLUMNS = ["Keywords", "Col_and_typ"]
+
+
+def publish_snapshot(catalog: pd.DataFrame, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    """
+    Publishes the data catalogue as an immutable snapshot that all workers memory-map.
+
+    The snapshot consists of the catalogue and an index of the row numbers per tag and per keyword, both stored as
+    uncompressed Arrow IPC files, so they can be memory-mapped without copying. The snapshot is written to a new
+    directory, and the version pointer is replaced atomically only once it is complete.
+
+    Parameters:
+    ----------
+    catalog : pd.DataFrame
+        The data catalogue, the row numbers are used as IDs like when it is loaded from the JSON file.
+    snapshot_dir : str, optional
+        The directory of the snapshots (default is SNAPSHOT_DIR).
+
+    Returns:
+    -------
+    str
+        The version of the snapshot.
+    """
+    import pyarrow as pa
+
+    catalog = catalog.reset_index(drop=True)
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_dir = os.path.join(snapshot_dir, f".{version}")
+    os.makedirs(tmp_dir)
+
+    table = catalog.copy()
+    for col in JSON_COLUMNS:
+        if col in table.columns:
+            table[col] = table[col].map(lambda value: json.dumps(value, default=str))
+    _write_arrow(
+        pa.Table.from_pandas(table, preserve_index=False),
+        os.path.join(tmp_dir, "catalog.arrow"),
+    )
+
+    # row numbers of the datasets per tag and per keyword, to filter without reading the catalogue
+    index = {}
+    for row, tag in enumerate(catalog["Tag"]):
+        index.setdefault(("tag", tag), []).append(row)
+    for row, keywords in enumerate(catalog["Keywords"]):
+        for keyword in set(keywords) if isinstance(keywords, list) else []:
+            index.setdefault(("keyword", keyword), []).append(row)
+    _write_arrow(
+        pa.table(
+            {
+                "kind": [kind for kind, _ in index],
+                "value": [str(value) for _, value in index],
+                "rows": pa.array(list(index.values()), type=pa.list_(pa.int32())),
+            }
+        ),
+        os.path.join(tmp_dir, "index.arrow"),
+    )
+
+    os.rename(tmp_dir, os.path.join(snapshot_dir, version))
+
+    # the pointer is written to a temporary file first, os.replace flips it atomically
+    tmp_current = os.path.join(snapshot_dir, f".{CURRENT_NAME}-{version}")
+    with open(tmp_current, "w") as file:
+        file.write(version)
+    os.replace(tmp_current, os.path.join(snapshot_dir, CURRENT_NAME))
+
+    # workers still mapping an old version keep their mapping, the files are only unlinked
+    versions = sorted(name for name in os.listdir(snapshot_dir) if name[0].isdigit())
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+    return version
+
+
+def _write_arrow(table, path: str):
+    """
+    Writes an Arrow table to an uncompressed Arrow IPC file.
+    """
+    import pyarrow as pa
+
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_arrow(path: str):
+    """
+    Memory-maps an Arrow IPC file read-only and returns its table, the data is not copied into the process.
+    """
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class CatalogSnapshot:
+    """
+    A class to access a published snapshot of the data catalogue.
+
+    The catalogue is memory-mapped read-only, so all workers share the pages of the same copy. Only the rows left
+    after filtering by tag and keywords are converted to a DataFrame.
+
+    Attributes:
+    ----------
+    version : str
+        The version of the snapshot.
+    table : pyarrow.Table
+        The memory-mapped catalogue.
+    index : pyarrow.Table
+        The memory-mapped row numbers per tag and per keyword.
+
+    Methods:
+    -------
+    filter_rows(tag: str = None, keys: list = None) -> np.ndarray
+        Returns the row numbers of the datasets with the tag and at least one of the keywords.
+
+    to_pandas(rows: np.ndarray = None) -> pd.DataFrame
+        Returns rows of the catalogue as DataFrame.
+
+    filter(tag: str = None, keys: list = None) -> pd.DataFrame
+        Returns the filtered catalogue as DataFrame, like filter_catalog.
+    """
+
+    def __init__(self, version: str, snapshot_dir: str = SNAPSHOT_DIR):
+        """
+        Memory-maps the catalogue and the index of a snapshot.
+
+        Parameters:
+        ----------
+        version : str
+            The version of the snapshot.
+        snapshot_dir : str, optional
+            The directory of the snapshots (default is SNAPSHOT_DIR).
+        """
+        path = os.path.join(snapshot_dir, version)
+        self.version = version
+        self.table = _read_arrow(os.path.join(path, "catalog.arrow"))
+        self.index = _read_arrow(os.path.join(path, "index.arrow"))
+
+        # position of every tag and keyword in the index, the row numbers stay in the mapped file
+        self._positions = {
+            (kind, value): position
+            for position, (kind, value) in enumerate(
+                zip(
+                    self.index.column("kind").to_pylist(),
+                    self.index.column("value").to_pylist(),
+                )
+            )
+        }
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def _rows(self, kind: str, value: str) -> np.ndarray:
+        """
+        Returns the row numbers of the datasets with a tag or keyword.
+        """
+        position = self._positions.get((kind, value))
+        if position is None:
+            return np.array([], dtype=np.int32)
+        return self.index.column("rows")[position].values.to_numpy()
+
+    def filter_rows(self, tag: str = None, keys: list = None) -> np.ndarray:
+        """
+        Returns the row numbers of the datasets with the tag and at least one of the keywords.
+
+        Parameters:
+        ----------
+        tag : str, optional
+            The tag the datasets must have (default is None, no filtering by tag).
+        keys : list, optional
+            The keywords of which the datasets must have at least one (default is None, no filtering by keywords).
+
+        Returns:
+        -------
+        np.ndarray
+            The sorted row numbers.
+        """
+        rows = np.arange(len(self))
+        if tag is not None:
+            rows = self._rows("tag", tag)
+        if keys is not None:
+            keyword_rows = [self._rows("keyword", key) for key in keys]
+            if keyword_rows:
+                rows = np.intersect1d(rows, np.concatenate(keyword_rows))
+            else:
+                rows = rows[:0]
+        return np.sort(rows).astype(np.int64)
+
+    def to_pandas(self, rows: np.ndarray = None) -> pd.DataFrame:
+        """
+        Returns rows of the catalogue as DataFrame, with the row numbers as index.
+
+        Parameters:
+        ----------
+        rows : np.ndarray, optional
+            The row numbers (default is None, the whole catalogue).
+
+        Returns:
+        -------
+        pd.DataFrame
+            The rows of the catalogue.
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        df = self.table.take(rows).to_pandas()
+        for col in JSON_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.Series(
+                    [json.loads(value) for value in df[col]], index=df.index, dtype=object
+                )
+        df.index = pd.Index(rows)
+        return df
+
+    def filter(self, tag: str = None, keys: list = None) -> pd.DataFrame:
+        """
+        Returns the catalogue filtered by a tag and/or a list of keywords, like filter_catalog.
+
+        Parameters:
+        ----------
+        tag : str, optional
+            The tag the datasets must have (default is None, no filtering by tag).
+        keys : list, optional
+            The keywords of which the datasets must have at least one (default is None, no filtering by keywords).
+
+        Returns:
+        -------
+        pd.DataFrame
+            The filtered catalogue, the index is the row number in the full catalogue.
+        """
+        return self.to_pandas(self.filter_rows(tag, keys))
+
+
+_snapshot = None
+
+
+def get_snapshot(snapshot_dir: str = SNAPSHOT_DIR) -> CatalogSnapshot:
+    """
+    Returns the current snapshot of the catalogue, a newly published version is mapped on the next call.
+
+    Parameters:
+    ----------
+    snapshot_dir : str, optional
+        The directory of the snapshots (default is SNAPSHOT_DIR).
+
+    Returns:
+    -------
+    CatalogSnapshot or None
+        The current snapshot, None if no snapshot has been published yet.
+    """
+    global _snapshot
+
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_NAME)) as file:
+            version = file.read().strip()
+    except FileNotFoundError:
+        return None
+
+    if _snapshot is None or _snapshot.version != version:
+        _snapshot = CatalogSnapshot(version, snapshot_dir)
+    return _snapshot
+
+
+if __name__ == "__main__":
+    # publishes a snapshot of the catalogue JSON file, e.g. after deployment
+    import backend.general_methods as gm
+
+    print(f"Published catalogue snapshot {publish_snapshot(gm.load_catalog())}")
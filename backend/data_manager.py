@@ -1,81 +1,114 @@
 import pandas as pd
+from backend.cache import get_cache
+from backend.duckdb_join import ParquetJoinResult
+
+
+# Time in seconds the data of a session is kept after it was last stored
+SESSION_TTL = 24 * 3600
 
 
 class DataManager:
     """
-    A class to manage a shared Pandas DataFrame.
+    A class to manage the Pandas DataFrame of every user session.
 
-    The DataManager class provides methods to store, retrieve, and check the status of a
-    Pandas DataFrame. This can be useful in scenarios where data needs to be shared
-    or managed across different parts of an application.
+    The DataManager class provides methods to store, retrieve, and check the status of the
+    Pandas DataFrame of a session. Every browser session has its own id (kept in a dcc.Store),
+    so users never see or join the data of other users.
+
+    If a disk cache is given, the DataFrames are stored in the cache instead of the process memory, so they are shared
+    with the other web workers and the background jobs of the long-running callbacks, which run in separate processes.
+    The data of a session expires SESSION_TTL seconds after it was last stored.
 
     Attributes:
     ----------
-    shared_data : pd.DataFrame or None
-        A DataFrame to store the data provided by the user. Initialized to None.
+    shared_data : dict
+        The DataFrames provided by the users, keyed by session id. Initialized empty.
+    cache : diskcache.Cache or None
+        A disk cache to store the DataFrames in. Initialized to None.
 
     Methods:
     -------
-    set_data(data: pd.DataFrame)
-        Stores the provided DataFrame in the shared_data attribute.
-
-    get_data() -> pd.DataFrame
-        Returns the stored DataFrame.
+    set_data(data: pd.DataFrame, session_id: str)
+        Stores the provided DataFrame for a session.
 
-    get_status() -> bool
-        Returns True if a DataFrame is stored, otherwise False.
+    get_data(session_id: str) -> pd.DataFrame
+        Returns the DataFrame stored for a session.
 
-    Note:
-    -------
-    In later iterations and for production, the data manager should be replaced with a dash Data Store
+    get_status(session_id: str) -> bool
+        Returns True if a DataFrame is stored for the session, otherwise False.
     """
 
-    def __init__(self):
+    def __init__(self, cache=None):
         """
         Initializes the DataManager with no data.
+
+        Parameters:
+        ----------
+        cache : diskcache.Cache, optional
+            A disk cache to store the DataFrames in (default is None, the DataFrames are kept in memory).
         """
-        self.shared_data = None
+        self.cache = cache
+        self.shared_data = {}
 
-    def set_data(self, data: pd.DataFrame):
+    def set_data(self, data: pd.DataFrame, session_id: str):
         """
-        Stores the provided DataFrame.
+        Stores the provided DataFrame for a session.
 
         Parameters:
         ----------
-        data : pd.DataFrame
-            The DataFrame to store in the shared_data attribute.
+        data : pd.DataFrame or ParquetJoinResult
+            The DataFrame, or the result of an out-of-core join, to store.
+        session_id : str
+            The id of the user session.
 
         Raises:
         ------
         ValueError
-            If the provided data is not a Pandas DataFrame.
+            If the provided data is neither a Pandas DataFrame nor a ParquetJoinResult, or no session id is given.
         """
-        if isinstance(data, pd.DataFrame):
-            self.shared_data = data
+        if not isinstance(data, (pd.DataFrame, ParquetJoinResult)):
+            raise ValueError("Data must be a Pandas DataFrame or a ParquetJoinResult")
+        if not session_id:
+            raise ValueError("A session id is required")
+
+        if self.cache is not None:
+            self.cache.set(("session_data", session_id), data, expire=SESSION_TTL)
         else:
-            raise ValueError("Data must be a Pandas DataFrame")
+            self.shared_data[session_id] = data
 
-    def get_data(self) -> pd.DataFrame:
+    def get_data(self, session_id: str) -> pd.DataFrame:
         """
-        Returns the stored DataFrame.
+        Returns the DataFrame stored for a session.
+
+        Parameters:
+        ----------
+        session_id : str
+            The id of the user session.
 
         Returns:
         -------
-        pd.DataFrame
-            The DataFrame stored in the shared_data attribute.
+        pd.DataFrame or ParquetJoinResult or None
+            The DataFrame of the session, None if nothing is stored.
         """
-        return self.shared_data
+        if self.cache is not None:
+            return self.cache.get(("session_data", session_id))
+        return self.shared_data.get(session_id)
 
-    def get_status(self) -> bool:
+    def get_status(self, session_id: str) -> bool:
         """
-        Checks if a DataFrame is stored.
+        Checks if a DataFrame is stored for a session.
+
+        Parameters:
+        ----------
+        session_id : str
+            The id of the user session.
 
         Returns:
         -------
         bool
-            True if shared_data is not None, otherwise False.
+            True if a DataFrame is stored, otherwise False.
         """
-        return self.shared_data is not None
+        return self.get_data(session_id) is not None
 
 
-manager = DataManager()
+manager = DataManager(get_cache("data"))
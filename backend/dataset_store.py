@@ -0,0 +1,510 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from backend.cache import CACHE_DIR
+from backend.tracing import registry
+
+# Directory of the locally stored catalogue datasets
+DATASET_DIR = os.path.join(CACHE_DIR, "datasets")
+
+# Maximum size of the stored datasets, the least recently used datasets are evicted first
+DATASET_STORE_SIZE = int(os.environ.get("DATAJOINER_DATASET_STORE_SIZE_MB", 2048)) * 2**20
+
+# Time in seconds after which files no longer referenced by any metadata are deleted, a join may still read the
+# files of the previous version of a dataset, and a writer may not have published its metadata yet
+ORPHAN_TTL = 3600
+
+# Number of rows per row group, the unit in which the stored datasets are read
+ROW_GROUP_ROWS = 50000
+
+# Maximum number of join columns a dataset is stored sorted by, every column costs one copy of the dataset
+MAX_KEY_COLUMNS = 2
+
+# False positive rate of the bloom filters of the row groups
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# Keys of the two hash functions of the bloom filters
+BLOOM_HASH_KEYS = ("datajoinerbloom1", "datajoinerbloom2")
+
+
+class BloomFilter:
+    """
+    A class for a bloom filter over the normalized key values of a row group.
+
+    A bloom filter answers whether a key may be contained in the row group. It never misses a contained key, but
+    may wrongly report a key as contained with a small probability. The keys are hashed vectorized with numpy.
+
+    Attributes:
+    ----------
+    num_bits : int
+        The size of the filter in bits.
+    num_hashes : int
+        The number of bit positions set per key.
+    bits : np.ndarray
+        The bits of the filter.
+
+    Methods:
+    -------
+    add(keys: np.ndarray)
+        Adds keys to the filter.
+
+    might_contain_any(keys: np.ndarray) -> bool
+        Returns False if none of the keys is contained, otherwise True.
+    """
+
+    def __init__(self, num_keys: int, bits: bytes = None, num_hashes: int = None):
+        """
+        Initializes an empty bloom filter for the given number of keys, or restores a serialized one.
+
+        Parameters:
+        ----------
+        num_keys : int
+            The expected number of keys.
+        bits : bytes, optional
+            The bits of a serialized filter (default is None, an empty filter).
+        num_hashes : int, optional
+            The number of hashes of a serialized filter (default is None, computed from the false positive rate).
+        """
+        if bits is not None:
+            packed = np.frombuffer(bits, dtype=np.uint8)
+            self.bits = np.unpackbits(packed, bitorder="little")
+            self.num_bits = len(self.bits)
+            self.num_hashes = num_hashes
+            return
+
+        num_keys = max(num_keys, 1)
+        num_bits = -num_keys * np.log(BLOOM_FALSE_POSITIVE_RATE) / np.log(2) ** 2
+        self.num_bits = int(np.ceil(num_bits / 8)) * 8
+        self.num_hashes = max(int(round(self.num_bits / num_keys * np.log(2))), 1)
+        self.bits = np.zeros(self.num_bits, dtype=np.uint8)
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Returns the bit positions of the keys (double hashing), one row per key.
+        """
+        keys = np.asarray(keys, dtype=object)
+        first = pd.util.hash_array(keys, hash_key=BLOOM_HASH_KEYS[0])
+        second = pd.util.hash_array(keys, hash_key=BLOOM_HASH_KEYS[1]) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(
+            self.num_bits
+        )
+
+    def add(self, keys: np.ndarray):
+        """
+        Adds keys to the filter.
+        """
+        if len(keys):
+            self.bits[self._positions(keys).ravel()] = 1
+
+    def might_contain_any(self, keys: np.ndarray) -> bool:
+        """
+        Returns False if none of the keys is contained, otherwise True.
+        """
+        if not len(keys):
+            return False
+        return bool(self.bits[self._positions(keys)].all(axis=1).any())
+
+    def to_dict(self) -> dict:
+        """
+        Serializes the filter for the JSON metadata.
+        """
+        packed = np.packbits(self.bits, bitorder="little").tobytes()
+        return {
+            "bits": base64.b64encode(packed).decode(),
+            "num_hashes": self.num_hashes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Restores a filter serialized with to_dict.
+        """
+        return cls(0, base64.b64decode(data["bits"]), data["num_hashes"])
+
+
+def normalize_keys(values: pd.Series) -> pd.Series:
+    """
+    Normalizes key values to strings, so the same key has the same representation in both datasets.
+
+    Integral numbers are written without decimals, e.g. 142263.0 becomes '142263'. Missing values are dropped.
+
+    Parameters:
+    ----------
+    values : pd.Series
+        The key values.
+
+    Returns:
+    -------
+    pd.Series
+        The normalized key values.
+    """
+    values = values.dropna()
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float).map(
+            lambda value: str(int(value)) if value.is_integer() else str(value)
+        )
+    return values.astype(str)
+
+
+def likely_join_columns(
+    df: pd.DataFrame, col_and_typ: dict = None, required: str = None
+) -> list:
+    """
+    Returns the columns of a catalogue dataset that are most likely used as join columns.
+
+    Columns of integer or text type (according to the column types in the catalogue) are ranked by the share of
+    distinct values, as identifiers and codes are the typical join columns.
+
+    Parameters:
+    ----------
+    df : pd.DataFrame
+        The catalogue dataset.
+    col_and_typ : dict, optional
+        The column types from the catalogue (default is None, the types of the DataFrame are used).
+    required : str, optional
+        A column that is always included, e.g. the join column found by the retriever (default is None).
+
+    Returns:
+    -------
+    list
+        At most MAX_KEY_COLUMNS column names, the most likely first.
+    """
+    if not isinstance(col_and_typ, dict):
+        col_and_typ = {col: str(dtype) for col, dtype in df.dtypes.items()}
+
+    candidates = [
+        col
+        for col, dtype in col_and_typ.items()
+        if col in df.columns
+        and ("int" in dtype or dtype in ("object", "str", "string"))
+        and "geometry" not in col.lower()
+    ]
+    ranked = sorted(
+        candidates, key=lambda col: df[col].nunique() / max(len(df), 1), reverse=True
+    )
+
+    if required is not None and required in df.columns:
+        ranked = [required] + [col for col in ranked if col != required]
+    return ranked[:MAX_KEY_COLUMNS]
+
+
+class DatasetStore:
+    """
+    A class to store downloaded catalogue datasets locally, so that a join reads only the parts it needs.
+
+    Every dataset is stored once per likely join column as a Parquet file sorted by that column. For every row group
+    the range of its keys, whether it contains missing keys, and a bloom filter of its keys are kept in a JSON
+    metadata file. For a left join only catalogue rows whose key appears in the user dataset matter, so a semi-join
+    reads only the row groups that can contain one of the user's keys.
+
+    Every stored version of a dataset gets files of its own, and its metadata is published last with an atomic
+    replace, so the metadata always describes the files it points to, also if several processes store the same
+    dataset. The size of the directory is bounded, the least recently used datasets are evicted first.
+
+    Attributes:
+    ----------
+    directory : str
+        The directory of the stored datasets.
+    size_limit : int
+        The maximum size of the stored datasets in bytes.
+
+    Methods:
+    -------
+    put(link: str, validators: dict, df: pd.DataFrame, key_columns: list, content_hash: str)
+        Stores a dataset.
+
+    get_metadata(link: str, validators: dict) -> dict or None
+        Returns the metadata of a stored dataset if it is up to date.
+
+    read_semi_join(metadata: dict, key_column: str, keys: pd.Series) -> pd.DataFrame
+        Reads the rows of a stored dataset whose key is in the given keys.
+
+    evict()
+        Deletes the least recently used datasets above the size limit and files no longer referenced.
+    """
+
+    def __init__(self, directory: str = DATASET_DIR, size_limit: int = DATASET_STORE_SIZE):
+        """
+        Initializes the DatasetStore in the given directory.
+
+        Parameters:
+        ----------
+        directory : str, optional
+            The directory of the stored datasets (default is DATASET_DIR).
+        size_limit : int, optional
+            The maximum size of the stored datasets in bytes (default is DATASET_STORE_SIZE).
+        """
+        self.directory = directory
+        self.size_limit = size_limit
+
+    def _path(self, link: str, suffix: str) -> str:
+        """
+        Returns the path of a file of a stored dataset.
+        """
+        name = hashlib.sha256(link.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}{suffix}")
+
+    def put(
+        self,
+        link: str,
+        validators: dict,
+        df: pd.DataFrame,
+        key_columns: list,
+        content_hash: str,
+    ):
+        """
+        Stores a dataset, sorted by each of the key columns, with the metadata of its row groups.
+
+        Parameters:
+        ----------
+        link : str
+            The link to the CSV file of the dataset.
+        validators : dict
+            The HTTP validators of the CSV file, used to detect changes.
+        df : pd.DataFrame
+            The dataset.
+        key_columns : list
+            The likely join columns.
+        content_hash : str
+            The content hash of the dataset.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        metadata = {
+            "link": link,
+            "validators": validators,
+            "content_hash": content_hash,
+            "files": {},
+        }
+
+        # the files of this version are only referenced once its metadata is published
+        version = uuid.uuid4().hex
+        for number, key_column in enumerate(key_columns):
+            path = self._path(link, f"_{version}_{number}.parquet")
+            try:
+                sorted_df = df.sort_values(key_column, kind="stable", na_position="first")
+                pq.write_table(
+                    pa.Table.from_pandas(sorted_df, preserve_index=False),
+                    path,
+                    row_group_size=ROW_GROUP_ROWS,
+                )
+            except (TypeError, pa.ArrowException) as e:
+                # keys of mixed types cannot be sorted, columns of mixed types cannot be converted to Arrow
+                print(f"Error storing {link} sorted by {key_column}: {e}")
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            row_groups = []
+            for start in range(0, len(sorted_df), ROW_GROUP_ROWS):
+                keys = sorted_df[key_column].iloc[start : start + ROW_GROUP_ROWS]
+                present = keys.dropna()
+                normalized = normalize_keys(present).unique()
+                bloom = BloomFilter(len(normalized))
+                bloom.add(normalized)
+                try:
+                    key_range = [_json_value(present.min()), _json_value(present.max())]
+                except TypeError:
+                    # keys of mixed types have no order, only the bloom filter is used
+                    key_range = None
+                row_groups.append(
+                    {
+                        "range": key_range if len(present) else None,
+                        "empty": len(present) == 0,
+                        "has_null": bool(keys.isna().any()),
+                        "bloom": bloom.to_dict(),
+                    }
+                )
+
+            metadata["files"][key_column] = {
+                "path": path,
+                "numeric": bool(pd.api.types.is_numeric_dtype(df[key_column])),
+                "row_groups": row_groups,
+            }
+
+        if not metadata["files"]:
+            return
+
+        metadata_path = self._path(link, ".json")
+        tmp_path = f"{metadata_path}.{version}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(metadata, file)
+        os.replace(tmp_path, metadata_path)
+
+        self.evict()
+
+    def get_metadata(self, link: str, validators: dict) -> dict:
+        """
+        Returns the metadata of a stored dataset if the CSV file has not changed since it was stored.
+
+        Parameters:
+        ----------
+        link : str
+            The link to the CSV file of the dataset.
+        validators : dict
+            The current HTTP validators of the CSV file.
+
+        Returns:
+        -------
+        dict or None
+            The metadata, None if the dataset is not stored or outdated.
+        """
+        metadata_path = self._path(link, ".json")
+        if not validators or not os.path.exists(metadata_path):
+            return None
+
+        try:
+            with open(metadata_path) as file:
+                metadata = json.load(file)
+            # the time of the last use decides which datasets are evicted first
+            os.utime(metadata_path)
+        except FileNotFoundError:
+            # evicted in the meantime
+            return None
+        if metadata["validators"] != validators:
+            return None
+        return metadata
+
+    def read_semi_join(
+        self, metadata: dict, key_column: str, keys: pd.Series
+    ) -> pd.DataFrame:
+        """
+        Reads the rows of a stored dataset whose key is in the given keys, skipping all other row groups.
+
+        Parameters:
+        ----------
+        metadata : dict
+            The metadata of the stored dataset.
+        key_column : str
+            The join column of the dataset.
+        keys : pd.Series
+            The keys of the user dataset.
+
+        Returns:
+        -------
+        pd.DataFrame
+            The rows of the dataset matching one of the keys.
+        """
+        import pyarrow.parquet as pq
+
+        file_metadata = metadata["files"][key_column]
+        has_null = bool(keys.isna().any())
+        if file_metadata["numeric"]:
+            typed_keys = pd.to_numeric(keys.dropna(), errors="coerce").dropna()
+        else:
+            typed_keys = keys.dropna().astype(str)
+        typed_keys = np.sort(typed_keys.unique())
+        normalized = normalize_keys(pd.Series(typed_keys)).to_numpy()
+
+        selected = []
+        for number, row_group in enumerate(file_metadata["row_groups"]):
+            if has_null and row_group["has_null"]:
+                selected.append(number)
+                continue
+            if row_group["empty"]:
+                continue
+
+            # keys within the range of the row group, found by binary search in the sorted keys
+            start, end = 0, len(typed_keys)
+            if row_group["range"] is not None:
+                start = np.searchsorted(typed_keys, row_group["range"][0], side="left")
+                end = np.searchsorted(typed_keys, row_group["range"][1], side="right")
+            if start == end:
+                continue
+
+            bloom = BloomFilter.from_dict(row_group["bloom"])
+            if bloom.might_contain_any(normalized[start:end]):
+                selected.append(number)
+
+        registry.increment(
+            "datajoiner_dataset_store_row_groups_total", len(selected), result="read"
+        )
+        registry.increment(
+            "datajoiner_dataset_store_row_groups_total",
+            len(file_metadata["row_groups"]) - len(selected),
+            result="skipped",
+        )
+
+        parquet_file = pq.ParquetFile(file_metadata["path"])
+        df = parquet_file.read_row_groups(selected).to_pandas()
+        if has_null:
+            return df[df[key_column].isin(typed_keys) | df[key_column].isna()]
+        return df[df[key_column].isin(typed_keys)]
+
+
+    def evict(self):
+        """
+        Deletes the least recently used datasets while the directory is larger than the size limit, and the files
+        that have not been referenced by any metadata for ORPHAN_TTL seconds (earlier versions, failed writes).
+        """
+        files = {}
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file():
+                    files[entry.name] = entry.stat()
+            except FileNotFoundError:
+                pass
+
+        # the files of every dataset, keyed by the name of its metadata file
+        datasets = {}
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    metadata = json.load(file)
+            except (OSError, ValueError):
+                continue
+            datasets[name] = [
+                os.path.basename(file_metadata["path"])
+                for file_metadata in metadata["files"].values()
+            ]
+        referenced = {name for names in datasets.values() for name in names}
+
+        now = time.time()
+        for name, stat in list(files.items()):
+            if (
+                name not in datasets
+                and name not in referenced
+                and now - stat.st_mtime > ORPHAN_TTL
+            ):
+                _remove(os.path.join(self.directory, name))
+                del files[name]
+
+        total = sum(stat.st_size for stat in files.values())
+        for name in sorted(datasets, key=lambda name: files[name].st_mtime):
+            if total <= self.size_limit:
+                break
+            # the metadata goes first, so no join finds the dataset while its files are deleted
+            for file_name in [name] + datasets[name]:
+                if file_name in files:
+                    _remove(os.path.join(self.directory, file_name))
+                    total -= files.pop(file_name).st_size
+
+
+def _remove(path: str):
+    """
+    Deletes a file, if it has not been deleted by another process in the meantime.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _json_value(value):
+    """
+    Converts a numpy scalar to a value that can be written to JSON.
+    """
+    return value.item() if hasattr(value, "item") else value
+
+
+dataset_store = DatasetStore()
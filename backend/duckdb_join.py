@@ -0,0 +1,509 @@
+import os
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from backend.cache import CACHE_DIR
+
+# Estimated size of a join result in bytes above which the join runs out-of-core in DuckDB instead of pandas
+JOIN_MEMORY_LIMIT = int(os.environ.get("DATAJOINER_JOIN_MEMORY_LIMIT_MB", 1024)) * 2**20
+
+# Directory of the Parquet files with the results of out-of-core joins and of the data DuckDB spills to disk
+JOIN_DIR = os.path.join(CACHE_DIR, "joins")
+
+# Number of threads DuckDB joins large in-memory datasets with, 1 joins them with pd.merge
+JOIN_THREADS = int(os.environ.get("DATAJOINER_JOIN_THREADS", os.cpu_count() or 1))
+
+# Number of rows of the left dataset from which in-memory joins run multi-threaded in DuckDB
+THREADED_JOIN_MIN_ROWS = int(os.environ.get("DATAJOINER_THREADED_JOIN_MIN_ROWS", 500000))
+
+# Size of a CSV file in bytes above which it is converted to Parquet instead of being read into memory, as pandas
+# needs several times the size of the file
+LARGE_FILE_BYTES = JOIN_MEMORY_LIMIT // 4
+
+# Time in hours after its last use a file in JOIN_DIR is deleted
+JOIN_FILE_TTL = float(os.environ.get("DATAJOINER_JOIN_FILE_TTL_HOURS", 24)) * 3600
+
+# The directory is cleaned up at most every ten minutes per process
+CLEANUP_INTERVAL = 600
+_last_cleanup = 0.0
+
+
+class ParquetJoinResult:
+    """
+    A class to access a dataset stored in a Parquet file instead of memory: the result of an out-of-core join, or a
+    user or catalogue dataset too large to be read into memory.
+
+    The dataset can be read in batches, column by column, page by page for the paginated data table, or written to a
+    CSV file, without loading it into memory as a whole.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the Parquet file.
+    file_columns : list
+        The column names in the file.
+    columns : list
+        The column names of the dataset.
+    num_rows : int
+        The number of rows of the dataset.
+    renamed : dict
+        The new names of renamed columns, keyed by their names in the file.
+
+    Methods:
+    -------
+    rename(columns: dict) -> ParquetJoinResult
+        Returns the dataset with renamed columns, without rewriting the file.
+
+    column(name: str) -> pd.Series
+        Returns one column of the dataset.
+
+    iter_batches(batch_size: int = 100000)
+        Yields the dataset as DataFrames of at most batch_size rows.
+
+    page(page_current: int, page_size: int) -> pd.DataFrame
+        Returns one page of the dataset.
+
+    to_csv(path: str, **kwargs)
+        Writes the dataset to a CSV file batch by batch.
+    """
+
+    def __init__(self, path: str, renamed: dict = None):
+        """
+        Initializes the ParquetJoinResult with the metadata of the Parquet file.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the Parquet file.
+        renamed : dict, optional
+            The new names of renamed columns, keyed by their names in the file (default is None).
+        """
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path)
+        self.path = path
+        self.renamed = dict(renamed or {})
+        self.file_columns = metadata.schema_arrow.names
+        self.columns = [self.renamed.get(col, col) for col in self.file_columns]
+        self.num_rows = metadata.metadata.num_rows
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def rename(self, columns: dict) -> "ParquetJoinResult":
+        """
+        Returns the dataset with renamed columns, like pd.DataFrame.rename, without rewriting the file.
+
+        Parameters:
+        ----------
+        columns : dict
+            The new column names, keyed by the current ones.
+
+        Returns:
+        -------
+        ParquetJoinResult
+            The dataset with the new column names.
+        """
+        renamed = {
+            col: columns.get(self.renamed.get(col, col), self.renamed.get(col, col))
+            for col in self.file_columns
+        }
+        return ParquetJoinResult(self.path, renamed)
+
+    def column(self, name: str) -> pd.Series:
+        """
+        Returns one column of the dataset, only this column is read from the file.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the column.
+
+        Returns:
+        -------
+        pd.Series
+            The column.
+
+        Raises:
+        ------
+        KeyError
+            If the dataset has no column with the name.
+        """
+        import pyarrow.parquet as pq
+
+        if name not in self.columns:
+            raise KeyError(name)
+        file_column = self.file_columns[self.columns.index(name)]
+        series = pq.read_table(self.path, columns=[file_column]).column(0).to_pandas()
+        return series.rename(name)
+
+    def iter_batches(self, batch_size: int = 100000):
+        """
+        Yields the dataset as DataFrames of at most batch_size rows.
+
+        Parameters:
+        ----------
+        batch_size : int, optional
+            The maximum number of rows per batch (default is 100000).
+        """
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(self.path).iter_batches(batch_size=batch_size):
+            yield batch.to_pandas().rename(columns=self.renamed)
+
+    def page(self, page_current: int, page_size: int) -> pd.DataFrame:
+        """
+        Returns one page of the dataset.
+
+        Parameters:
+        ----------
+        page_current : int
+            The number of the page, starting at 0.
+        page_size : int
+            The number of rows per page.
+
+        Returns:
+        -------
+        pd.DataFrame
+            The rows of the page.
+        """
+        import duckdb
+
+        # the file is in use, it is kept by the cleanup of JOIN_DIR
+        os.utime(self.path)
+        return duckdb.execute(
+            "SELECT * FROM read_parquet(?) LIMIT ? OFFSET ?",
+            [self.path, page_size, page_current * page_size],
+        ).df().rename(columns=self.renamed)
+
+    def to_csv(self, path: str, **kwargs):
+        """
+        Writes the dataset to a CSV file batch by batch.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the CSV file.
+        **kwargs
+            Further arguments of pd.DataFrame.to_csv.
+        """
+        header = True
+        with open(path, "w", newline="") as file:
+            for batch in self.iter_batches():
+                batch.to_csv(file, header=header, index=False, **kwargs)
+                header = False
+
+
+def csv_to_parquet(
+    path: str, sep: str = ";", decimal: str = ",", encoding: str = "latin-1"
+) -> ParquetJoinResult:
+    """
+    Converts a CSV file to a Parquet file in JOIN_DIR with DuckDB, without reading it into memory.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the CSV file.
+    sep : str, optional
+        The separator of the columns (default is ";").
+    decimal : str, optional
+        The decimal separator (default is ",").
+    encoding : str, optional
+        The encoding of the file, "utf-8" or "latin-1" (default is "latin-1").
+
+    Returns:
+    -------
+    ParquetJoinResult
+        The dataset stored in the Parquet file.
+    """
+    import duckdb
+
+    cleanup_join_dir()
+    os.makedirs(JOIN_DIR, exist_ok=True)
+    parquet_path = os.path.join(JOIN_DIR, f"{uuid.uuid4().hex}.parquet")
+
+    options = f"delim = {_literal(sep)}, encoding = {_literal(encoding)}, header = true"
+    if decimal != "." and decimal != sep:
+        options += f", decimal_separator = {_literal(decimal)}"
+
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET memory_limit = '{max(JOIN_MEMORY_LIMIT // 2**20, 64)}MB'")
+        con.execute(f"SET temp_directory = {_literal(JOIN_DIR)}")
+        con.execute(
+            f"COPY (SELECT * FROM read_csv({_literal(path)}, {options})) "
+            f"TO {_literal(parquet_path)} (FORMAT PARQUET)"
+        )
+    finally:
+        con.close()
+
+    return ParquetJoinResult(parquet_path)
+
+
+def cleanup_join_dir(max_age: float = JOIN_FILE_TTL):
+    """
+    Deletes the files in JOIN_DIR (results of out-of-core joins, copies of cached results, CSV downloads) that have
+    not been used for max_age seconds.
+
+    Parameters:
+    ----------
+    max_age : float, optional
+        The time in seconds after the last use of a file (default is JOIN_FILE_TTL).
+    """
+    global _last_cleanup
+
+    now = time.time()
+    if now - _last_cleanup < CLEANUP_INTERVAL or not os.path.isdir(JOIN_DIR):
+        return
+    _last_cleanup = now
+
+    for entry in os.scandir(JOIN_DIR):
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            # deleted by another process in the meantime
+            pass
+
+
+def estimate_join_bytes(
+    left: pd.DataFrame, right: pd.DataFrame, left_on: str, right_on: str
+) -> int:
+    """
+    Estimates the memory needed by the result of a left join in pandas.
+
+    The number of result rows is estimated from the key counts of the right dataset, the size of a row from the
+    memory usage of both datasets.
+
+    Parameters:
+    ----------
+    left : pd.DataFrame
+        The left dataset.
+    right : pd.DataFrame
+        The right dataset.
+    left_on : str
+        The join column of the left dataset.
+    right_on : str
+        The join column of the right dataset.
+
+    Returns:
+    -------
+    int
+        The estimated size of the result in bytes.
+    """
+    if len(left) == 0:
+        return 0
+
+    key_counts = right[right_on].value_counts()
+    result_rows = left[left_on].map(key_counts).fillna(1).clip(lower=1).sum()
+
+    left_row_bytes = left.memory_usage(deep=True).sum() / len(left)
+    right_row_bytes = right.memory_usage(deep=True).sum() / max(len(right), 1)
+
+    return int(result_rows * (left_row_bytes + right_row_bytes))
+
+
+def _relation(con, name: str, data) -> str:
+    """
+    Makes a dataset available to DuckDB and returns the SQL expression to read it.
+
+    The dataset can be a DataFrame, a ParquetJoinResult, or the path of a Parquet or CSV file.
+    """
+    if isinstance(data, pd.DataFrame):
+        con.register(name, data)
+        return name
+    if isinstance(data, ParquetJoinResult):
+        if data.renamed:
+            select = ", ".join(
+                f"{_identifier(col)} AS {_identifier(data.renamed.get(col, col))}"
+                for col in data.file_columns
+            )
+            return f"(SELECT {select} FROM read_parquet({_literal(data.path)}))"
+        data = data.path
+    if data.endswith(".parquet"):
+        return f"read_parquet({_literal(data)})"
+    return f"read_csv_auto({_literal(data)})"
+
+
+def _columns(con, relation: str) -> list:
+    """
+    Returns the column names of a relation.
+    """
+    return [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {relation}").fetchall()]
+
+
+def _identifier(name: str) -> str:
+    """
+    Quotes a column name for SQL.
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    """
+    Quotes a string literal for SQL.
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def duckdb_left_join(
+    left, right, left_on: str, right_on: str, memory_limit: int = JOIN_MEMORY_LIMIT
+) -> ParquetJoinResult:
+    """
+    Joins the right dataset to the left dataset (left join) out-of-core in DuckDB.
+
+    DuckDB processes the join in a limited amount of memory and spills to disk, the result is written to a
+    Parquet file. The columns and the row order of the result are the same as with pd.merge(how="left").
+
+    Parameters:
+    ----------
+    left : pd.DataFrame, ParquetJoinResult or str
+        The left dataset, or the path of a Parquet or CSV file with it.
+    right : pd.DataFrame, ParquetJoinResult or str
+        The right dataset, or the path of a Parquet or CSV file with it.
+    left_on : str
+        The join column of the left dataset.
+    right_on : str
+        The join column of the right dataset.
+    memory_limit : int, optional
+        The memory DuckDB may use in bytes (default is JOIN_MEMORY_LIMIT).
+
+    Returns:
+    -------
+    ParquetJoinResult
+        The result of the join.
+    """
+    import duckdb
+
+    cleanup_join_dir()
+    os.makedirs(JOIN_DIR, exist_ok=True)
+    path = os.path.join(JOIN_DIR, f"{uuid.uuid4().hex}.parquet")
+
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET memory_limit = '{max(memory_limit // 2**20, 64)}MB'")
+        con.execute(f"SET temp_directory = {_literal(JOIN_DIR)}")
+        con.execute("SET preserve_insertion_order = true")
+
+        left_relation = _relation(con, "left_data", left)
+        right_relation = _relation(con, "right_data", right)
+        left_columns = _columns(con, left_relation)
+        right_columns = _columns(con, right_relation)
+
+        # name the columns like pd.merge: a common join key is kept once, other common columns get suffixes
+        same_key = left_on == right_on
+        overlapping = set(left_columns) & set(right_columns)
+        if same_key:
+            overlapping.discard(left_on)
+        select = [
+            f"l.{_identifier(col)} AS {_identifier(col + '_x')}"
+            if col in overlapping
+            else f"l.{_identifier(col)}"
+            for col in left_columns
+        ] + [
+            f"r.{_identifier(col)} AS {_identifier(col + '_y')}"
+            if col in overlapping
+            else f"r.{_identifier(col)}"
+            for col in right_columns
+            if not (same_key and col == right_on)
+        ]
+
+        # the row numbers restore the order of pd.merge after the join: the rows of the left dataset in their order,
+        # several matches of a left row in the order of the right dataset
+        # missing keys match each other, like in pd.merge
+        query = f"""
+            SELECT {", ".join(select)}
+            FROM (SELECT *, row_number() OVER () AS __left_row FROM {left_relation}) AS l
+            LEFT JOIN (SELECT *, row_number() OVER () AS __right_row FROM {right_relation}) AS r
+            ON l.{_identifier(left_on)} IS NOT DISTINCT FROM r.{_identifier(right_on)}
+            ORDER BY l.__left_row, r.__right_row
+        """
+        con.execute(f"COPY ({query}) TO {_literal(path)} (FORMAT PARQUET)")
+    finally:
+        con.close()
+
+    return ParquetJoinResult(path)
+
+
+def threaded_left_join(
+    left: pd.DataFrame,
+    right: pd.DataFrame,
+    left_on: str,
+    right_on: str,
+    threads: int = JOIN_THREADS,
+) -> pd.DataFrame:
+    """
+    Joins the right dataset to the left dataset (left join) in memory on several cores.
+
+    DuckDB only matches the join keys with its multi-threaded hash join and returns the pairs of matching row
+    numbers, the columns are then taken from the DataFrames by these row numbers. The columns, the data types and
+    the row order of the result are the same as with pd.merge(how="left"). Keys of different kinds (numbers on one
+    side, text on the other) or keys DuckDB cannot compare are left to pd.merge.
+
+    Parameters:
+    ----------
+    left : pd.DataFrame
+        The left dataset.
+    right : pd.DataFrame
+        The right dataset.
+    left_on : str
+        The join column of the left dataset.
+    right_on : str
+        The join column of the right dataset.
+    threads : int, optional
+        The number of threads of DuckDB (default is JOIN_THREADS).
+
+    Returns:
+    -------
+    pd.DataFrame
+        The result of the join.
+    """
+    import duckdb
+
+    # DuckDB would cast numbers to text to compare them, pd.merge rejects such keys
+    if pd.api.types.is_numeric_dtype(left[left_on]) != pd.api.types.is_numeric_dtype(
+        right[right_on]
+    ):
+        return pd.merge(left, right, left_on=left_on, right_on=right_on, how="left")
+
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET threads = {max(int(threads), 1)}")
+        con.register(
+            "left_keys",
+            pd.DataFrame({"k": left[left_on].to_numpy(), "i": np.arange(len(left))}),
+        )
+        con.register(
+            "right_keys",
+            pd.DataFrame({"k": right[right_on].to_numpy(), "j": np.arange(len(right))}),
+        )
+        # left rows without a match get the row number -1, several matches keep the order of the right dataset
+        pairs = con.execute(
+            """
+            SELECT l.i, coalesce(r.j, -1) AS j
+            FROM left_keys AS l
+            LEFT JOIN right_keys AS r ON l.k IS NOT DISTINCT FROM r.k
+            ORDER BY l.i, r.j
+            """
+        ).fetchnumpy()
+    except duckdb.Error as e:
+        print(f"Error in threaded join, joining with pandas: {e}")
+        return pd.merge(left, right, left_on=left_on, right_on=right_on, how="left")
+    finally:
+        con.close()
+
+    # reindex fills the rows without a match with missing values and converts the types like pd.merge
+    left_rows = left.take(np.asarray(pairs["i"])).reset_index(drop=True)
+    right_rows = right.reset_index(drop=True).reindex(np.asarray(pairs["j"]))
+    right_rows = right_rows.reset_index(drop=True)
+
+    # name the columns like pd.merge: a common join key is kept once, other common columns get suffixes
+    same_key = left_on == right_on
+    if same_key:
+        right_rows = right_rows.drop(columns=right_on)
+    overlapping = set(left_rows.columns) & set(right_rows.columns)
+    left_rows = left_rows.rename(columns={col: f"{col}_x" for col in overlapping})
+    right_rows = right_rows.rename(columns={col: f"{col}_y" for col in overlapping})
+
+    return pd.concat([left_rows, right_rows], axis=1)
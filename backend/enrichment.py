@@ -0,0 +1,246 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import backend.general_methods as gm
+from backend.duckdb_join import LARGE_FILE_BYTES, ParquetJoinResult
+from backend.dataset_store import dataset_store, likely_join_columns
+from backend.join_cache import get_validators, hash_dataframe, join_cache
+from backend.tracing import span
+
+
+def read_stored_candidate(
+    link: str, validators: dict, key_column: str, keys: pd.Series
+) -> tuple | None:
+    """
+    Reads the rows of a locally stored catalogue dataset that can match the given keys (semi-join).
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+    validators : dict
+        The HTTP validators of the CSV file.
+    key_column : str
+        The join column of the catalogue dataset.
+    keys : pd.Series
+        The keys of the user dataset.
+
+    Returns:
+    -------
+    tuple or None
+        The rows of the dataset matching the keys and the content hash of the whole dataset, or None if the dataset
+        is not stored, has changed or is not indexed by the key column.
+    """
+
+    metadata = dataset_store.get_metadata(link, validators)
+    if metadata is None or key_column not in metadata["files"]:
+        return None
+    try:
+        with span("dataset_store_read"):
+            candidate_df = dataset_store.read_semi_join(metadata, key_column, keys)
+    except FileNotFoundError:
+        # evicted since the metadata was read, the dataset has to be downloaded again
+        return None
+    return candidate_df, metadata["content_hash"]
+
+
+def download_candidate(
+    link: str, validators: dict, key_column: str, col_and_typ: dict = None
+) -> tuple:
+    """
+    Downloads a catalogue dataset completely and stores it for the next joins, or, if it is too large for memory,
+    streams it to a Parquet file that is joined out-of-core.
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+    validators : dict
+        The HTTP validators of the CSV file.
+    key_column : str
+        The join column of the catalogue dataset.
+    col_and_typ : dict, optional
+        The column types of the dataset from the catalogue (default is None).
+
+    Returns:
+    -------
+    tuple
+        The dataset (a ParquetJoinResult if it is too large for memory) and its content hash.
+    """
+
+    if int(validators.get("Content-Length", 0)) > LARGE_FILE_BYTES:
+        # too large for memory, the dataset is joined out-of-core from a Parquet file and not stored
+        candidate_df = gm.get_large_govdata_dataset(link)
+        return candidate_df, hash_dataframe(candidate_df)
+
+    candidate_df = gm.get_govdata_dataset(link)
+    content_hash = hash_dataframe(candidate_df)
+
+    # without validators a change of the dataset could not be detected, so it is not stored
+    if validators and key_column in candidate_df.columns:
+        # storing is best-effort, the downloaded dataset is used anyway
+        try:
+            with span("dataset_store_write"):
+                dataset_store.put(
+                    link,
+                    validators,
+                    candidate_df,
+                    likely_join_columns(candidate_df, col_and_typ, key_column),
+                    content_hash,
+                )
+        except Exception as e:
+            print(f"Error storing dataset {link}: {e}")
+
+    return candidate_df, content_hash
+
+
+def fetch_candidate(
+    link: str,
+    validators: dict,
+    key_column: str,
+    keys: pd.Series,
+    col_and_typ: dict = None,
+) -> tuple:
+    """
+    Retrieves the rows of a catalogue dataset needed for a left join on the given keys.
+
+    If the dataset is stored locally and has not changed, only the row groups that can contain one of the keys are
+    read (semi-join). Otherwise the dataset is downloaded completely and stored for the next joins, or, if it is too
+    large for memory, streamed to a Parquet file that is joined out-of-core.
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+    validators : dict
+        The HTTP validators of the CSV file.
+    key_column : str
+        The join column of the catalogue dataset.
+    keys : pd.Series
+        The keys of the user dataset.
+    col_and_typ : dict, optional
+        The column types of the dataset from the catalogue (default is None).
+
+    Returns:
+    -------
+    tuple
+        The dataset (or the rows of it matching the keys, or a ParquetJoinResult) and the content hash of the whole
+        dataset.
+    """
+
+    stored = read_stored_candidate(link, validators, key_column, keys)
+    if stored is not None:
+        return stored
+    return download_candidate(link, validators, key_column, col_and_typ)
+
+
+def enrich_dataset(
+    user_dataset: pd.DataFrame | ParquetJoinResult,
+    solutions: list,
+    catalog: pd.DataFrame,
+    set_progress=None,
+    fetch=fetch_candidate,
+) -> tuple:
+    """
+    Joins the catalogue datasets found by the retriever to the user dataset, reusing cached join results.
+
+    The join result is looked up in the join cache first. The catalogue datasets are only retrieved if the result
+    is not cached or one of them has changed since, and new results are stored in the cache.
+
+    Parameters:
+    ----------
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset, stored in a Parquet file if it is too large for memory.
+    solutions : list
+        The matching catalogue datasets, as dictionaries returned by the retriever.
+    catalog : pd.DataFrame
+        The data catalogue the IDs of the solutions refer to.
+    set_progress : function, optional
+        Function to report the progress as (percent, label) (default is None).
+    fetch : function, optional
+        Function retrieving a catalogue dataset, called with the arguments of fetch_candidate (default is
+        fetch_candidate).
+
+    Returns:
+    -------
+    tuple
+        The combined dataset (a ParquetJoinResult if it was joined out-of-core) and a dictionary mapping the name
+        of every source dataset to the list of the columns added from it.
+
+    Raises:
+    ------
+    ValueError
+        If none of the catalogue datasets could be retrieved.
+    """
+
+    links = {
+        solution["dataset_id"]: catalog.loc[solution["dataset_id"], "CSV"]
+        for solution in solutions
+    }
+    sources = {
+        dataset_id: f"{dataset_id}: {catalog.loc[dataset_id, 'Title']}"
+        for dataset_id in links
+    }
+
+    # the cached result can be used without a download if no catalogue dataset has changed
+    user_hash = hash_dataframe(user_dataset)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        validators = dict(zip(links, executor.map(get_validators, links.values())))
+    content_hashes = {
+        dataset_id: join_cache.content_hash(link, validators[dataset_id])
+        for dataset_id, link in links.items()
+    }
+    if None not in content_hashes.values():
+        cached = join_cache.get(user_hash, solutions, content_hashes)
+        if cached is not None:
+            return cached
+
+    if set_progress is not None:
+        set_progress((50, "Datensätze werden heruntergeladen"))
+
+    # get the datasets in parallel, locally stored datasets are only read where they match the user's keys
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {
+            solution["dataset_id"]: executor.submit(
+                fetch,
+                links[solution["dataset_id"]],
+                validators[solution["dataset_id"]],
+                solution["col_name_catalog"],
+                gm.get_column(user_dataset, solution["col_name_user"]),
+                catalog.loc[solution["dataset_id"], "Col_and_typ"],
+            )
+            for solution in solutions
+        }
+
+    candidates = []
+    content_hashes = {}
+    for solution in solutions:
+        dataset_id = solution["dataset_id"]
+        try:
+            candidate_df, content_hashes[dataset_id] = futures[dataset_id].result()
+        except Exception as e:
+            print(f"Error retrieving dataset {dataset_id}: {e}")
+            continue
+        join_cache.record_content_hash(
+            links[dataset_id], validators[dataset_id], content_hashes[dataset_id]
+        )
+        candidates.append((solution, candidate_df))
+
+    if not candidates:
+        raise ValueError("No catalogue dataset could be retrieved")
+
+    solutions = [solution for solution, _ in candidates]
+
+    # the result may be cached although the server sends no validators
+    cached = join_cache.get(user_hash, solutions, content_hashes)
+    if cached is not None:
+        return cached
+
+    if set_progress is not None:
+        set_progress((75, "Datensätze werden verbunden"))
+
+    combined_df, added_columns = gm.join_multiple_datasets(
+        user_dataset, candidates, sources
+    )
+    join_cache.set(user_hash, solutions, content_hashes, combined_df, added_columns)
+
+    return combined_df, added_columns
@@ -1,85 +1,148 @@
 from dash import html, dash_table
 import dash_bootstrap_components as dbc
 import pandas as pd
-from bs4 import BeautifulSoup
 import io
-import requests
-from backend.data_manager import manager
-
-
-def create_table(df: pd.DataFrame, highlights: list = None) -> list:
+import json
+import os
+import random
+import uuid
+from collections import Counter
+from typing import TYPE_CHECKING
+from backend.catalog_snapshot import get_snapshot
+from backend.duckdb_join import (
+    JOIN_DIR,
+    JOIN_MEMORY_LIMIT,
+    JOIN_THREADS,
+    THREADED_JOIN_MIN_ROWS,
+    ParquetJoinResult,
+    csv_to_parquet,
+    duckdb_left_join,
+    estimate_join_bytes,
+    threaded_left_join,
+)
+from backend.tracing import span
+
+# bs4 and requests are only needed for the catalogue update and downloads, they are imported on first use
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    import requests
+
+# Path of the JSON file that serves as the data catalogue
+CATALOG_PATH = "Lib/data_library.json"
+
+# Path of the JSON file with the precomputed options of the dropdown menus, written by the catalogue update
+OPTIONS_PATH = "Lib/dropdown_options.json"
+
+# Number of rows per page of the data table
+PAGE_SIZE = 25
+
+# Background colours of the columns added from the different catalogue datasets, the first one is light blue
+HIGHLIGHT_COLORS = [
+    "rgba(0, 159, 227, 0.3)",
+    "rgba(255, 179, 0, 0.3)",
+    "rgba(76, 175, 80, 0.3)",
+    "rgba(233, 30, 99, 0.3)",
+    "rgba(156, 39, 176, 0.3)",
+]
+
+
+def create_table(df: pd.DataFrame | ParquetJoinResult, highlights: list | dict = None) -> list:
     """
     Converts a DataFrame into a Dash DataTable and returns it along with a line break component.
 
-    If highlights are provided, specific columns will be highlighted.
+    If highlights are provided, specific columns will be highlighted. If they are given per source dataset, the
+    columns of every source get their own colour and a legend of the sources is shown above the table.
+    Results of out-of-core joins are not sent to the browser as a whole, the table loads them page by page.
 
     Parameters:
     ----------
-    df : pd.DataFrame
+    df : pd.DataFrame or ParquetJoinResult
         The DataFrame to be displayed in the Dash DataTable.
-    highlights : list, optional
-        A list of column names to be highlighted in the DataTable (default is None).
+    highlights : list or dict, optional
+        A list of column names to be highlighted in the DataTable, or a dictionary mapping the name of each source
+        dataset to the list of its column names (default is None).
 
     Returns:
     -------
     list
-        A list containing a Dash HTML component (line break) and the Dash DataTable.
-    """
-
-    if highlights is None:
-
-        ## Display DataFrame in a Data Table without highlights
-        data_table = dash_table.DataTable(
-            data=df.to_dict("records"),
-            columns=[{"name": col, "id": col} for col in df.columns],
-            style_table={"overflowX": "scroll"},
-            style_cell={
-                "minWidth": "180px",
-                "width": "180px",
-                "maxWidth": "180px",
-                "overflow": "hidden",
-                "textOverflow": "ellipsis",
-            },
-            sort_action="native",
-            filter_action="native",
-            page_action="native",
-            page_current=0,
-            page_size=25,
-        )
+        A list containing a Dash HTML component (line break), the legend of the sources if highlights are given
+        per source, and the Dash DataTable.
+    """
 
-    else:
-        # Highlight the new columns in the Data Table
-        style_data_conditional = [
-            {
-                "if": {"column_id": col},
-                "backgroundColor": "rgba(0, 159, 227, 0.3)",  # Light blue background
-                "color": "black",
-            }
-            for col in highlights
+    legend = []
+    if isinstance(highlights, dict):
+        # one colour per source dataset
+        colors = {
+            col: HIGHLIGHT_COLORS[i % len(HIGHLIGHT_COLORS)]
+            for i, cols in enumerate(highlights.values())
+            for col in cols
+        }
+        legend = [
+            html.Div(
+                [
+                    dbc.Badge(
+                        source,
+                        color="light",
+                        text_color="dark",
+                        className="me-2",
+                        style={
+                            "backgroundColor": HIGHLIGHT_COLORS[i % len(HIGHLIGHT_COLORS)]
+                        },
+                    )
+                    for i, source in enumerate(highlights)
+                ]
+            )
         ]
-        data_table = dash_table.DataTable(
-            data=df.to_dict("records"),
-            columns=[{"name": col, "id": col} for col in df.columns],
-            style_table={"overflowX": "scroll"},
-            style_cell={
-                "minWidth": "180px",
-                "width": "180px",
-                "maxWidth": "180px",
-                "overflow": "hidden",
-                "textOverflow": "ellipsis",
-            },
-            style_data_conditional=style_data_conditional,
-            sort_action="native",
-            filter_action="native",
-            page_action="native",
-            page_current=0,
-            page_size=25,
-        )
-
-    # Store DataFrame in Data Manager
-    manager.set_data(df)
+    elif highlights is not None:
+        colors = {col: HIGHLIGHT_COLORS[0] for col in highlights}
+    else:
+        colors = {}
+
+    # Highlight the new columns in the Data Table
+    style_data_conditional = [
+        {
+            "if": {"column_id": col},
+            "backgroundColor": color,  # Light blue background for a single source
+            "color": "black",
+        }
+        for col, color in colors.items()
+    ]
+
+    if isinstance(df, ParquetJoinResult):
+        # Results of out-of-core joins are paginated on the server, see the callback of the paged data table
+        table_data = {
+            "id": "data-table-paged",
+            "data": df.page(0, PAGE_SIZE).to_dict("records"),
+            "page_action": "custom",
+            "page_count": max(-(-df.num_rows // PAGE_SIZE), 1),
+            "sort_action": "none",
+            "filter_action": "none",
+        }
+    else:
+        table_data = {
+            "data": df.to_dict("records"),
+            "page_action": "native",
+            "sort_action": "native",
+            "filter_action": "native",
+        }
+
+    data_table = dash_table.DataTable(
+        columns=[{"name": col, "id": col} for col in df.columns],
+        style_table={"overflowX": "scroll"},
+        style_cell={
+            "minWidth": "180px",
+            "width": "180px",
+            "maxWidth": "180px",
+            "overflow": "hidden",
+            "textOverflow": "ellipsis",
+        },
+        style_data_conditional=style_data_conditional,
+        page_current=0,
+        page_size=PAGE_SIZE,
+        **table_data,
+    )
 
-    return [html.Br(), data_table]
+    return [html.Br(), *legend, data_table]
 
 
 def return_error_popup(error_message: str) -> dbc.Modal:
@@ -106,7 +169,7 @@ def return_error_popup(error_message: str) -> dbc.Modal:
     )
 
 
-def extract_csv_link(soup: BeautifulSoup) -> str:
+def extract_csv_link(soup: "BeautifulSoup") -> str:
     """
     Extracts the link to the CSV file from the detail pages of the datasets on govdata.
 
@@ -127,7 +190,7 @@ def extract_csv_link(soup: BeautifulSoup) -> str:
             return link
 
 
-def extract_keywords(soup: BeautifulSoup) -> list:
+def extract_keywords(soup: "BeautifulSoup") -> list:
     """
     Extracts the keywords from the detail pages of the datasets on govdata.
 
@@ -181,44 +244,79 @@ def detect_sep(csv: str, num_lines=5) -> int:
         return ";"
 
 
-def get_tags() -> list:
+def build_dropdown_options(full_data: pd.DataFrame) -> dict:
     """
-    Returns the different tags of the CSV files on govdata as a list.
+    Computes the options of the dropdown menus from the data catalogue.
+
+    Parameters:
+    ----------
+    full_data : pd.DataFrame
+        The data catalogue.
 
     Returns:
     -------
-    list
-        A list of tags, each represented as a dictionary with 'label' and 'value'.
+    dict
+        A dictionary with the list of tags under 'tags' and the number of datasets per keyword under 'keywords',
+        sorted by descending count.
     """
 
-    full_data = pd.read_json(
-        "Lib/data_library.json",
+    tag_list = [tag for tag in full_data.Tag.unique() if tag != "No Tag"]
+    keyword_counts = Counter(
+        item for sublist in full_data["Keywords"] for item in sublist
     )
+    return {"tags": tag_list, "keywords": dict(keyword_counts.most_common())}
 
-    tag_list = list(full_data.Tag.unique())
-    try:
-        tag_list.remove("No Tag")
-    except ValueError:
-        pass
-    return [{"label": item, "value": item} for item in tag_list]
+
+def write_dropdown_options(full_data: pd.DataFrame, path: str = OPTIONS_PATH):
+    """
+    Writes the options of the dropdown menus to a small JSON file, so the app does not need to parse the catalogue.
+
+    Parameters:
+    ----------
+    full_data : pd.DataFrame
+        The data catalogue.
+    path : str, optional
+        The path of the JSON file (default is OPTIONS_PATH).
+    """
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(build_dropdown_options(full_data), file, ensure_ascii=False, indent=4)
 
 
-def get_keywords() -> list:
+def load_dropdown_options(path: str = OPTIONS_PATH) -> dict:
     """
-    Returns the different keywords of the CSV files on govdata as a list.
+    Loads the precomputed options of the dropdown menus, they are computed from the catalogue if the file is missing.
+
+    Parameters:
+    ----------
+    path : str, optional
+        The path of the JSON file (default is OPTIONS_PATH).
 
     Returns:
     -------
-    list
-        A list of keywords, each represented as a dictionary with 'label' and 'value'.
+    dict
+        A dictionary with the list of tags under 'tags' and the number of datasets per keyword under 'keywords'.
     """
 
-    full_data = pd.read_json(
-        "Lib/data_library.json",
-    )
+    if not os.path.exists(path):
+        return build_dropdown_options(pd.read_json(CATALOG_PATH))
 
-    all_values = [item for sublist in full_data["Keywords"] for item in sublist]
-    return [{"label": item, "value": item} for item in list(set(all_values))]
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def get_tags() -> list:
+    """
+    Returns the different tags of the CSV files on govdata as a list.
+
+    Returns:
+    -------
+    list
+        A list of tags, each represented as a dictionary with 'label' and 'value'.
+    """
+
+    tag_list = load_dropdown_options()["tags"]
+    return [{"label": item, "value": item} for item in tag_list]
 
 
 def get_govdata_dataset(link: str) -> pd.DataFrame:
@@ -235,8 +333,445 @@ def get_govdata_dataset(link: str) -> pd.DataFrame:
     pd.DataFrame
         The retrieved dataset as a Pandas DataFrame.
     """
-    response = requests.get(link)
+    import requests
+
+    with span("download"):
+        response = requests.get(link)
+
+    with span("parse"):
+        csv_content = response.content.decode("iso-8859-1")
+
+        return pd.read_csv(io.StringIO(csv_content), sep=detect_sep(csv_content))
+
+
+def get_large_govdata_dataset(link: str, chunk_size: int = 2**20) -> ParquetJoinResult:
+    """
+    Retrieves a dataset from govdata that is too large to be read into memory.
+
+    The CSV file is streamed to disk and converted to a Parquet file with DuckDB, so it can be joined out-of-core.
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+    chunk_size : int, optional
+        The number of bytes read from the stream at once (default is 1 MiB).
+
+    Returns:
+    -------
+    ParquetJoinResult
+        The retrieved dataset stored in a Parquet file.
+    """
+    import requests
+
+    os.makedirs(JOIN_DIR, exist_ok=True)
+    csv_path = os.path.join(JOIN_DIR, f"download-{uuid.uuid4().hex}.csv")
+    try:
+        with span("download"):
+            with requests.get(link, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                with open(csv_path, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        file.write(chunk)
+
+        with span("parse"):
+            with open(csv_path, "rb") as file:
+                sep = detect_sep(file.read(chunk_size).decode("iso-8859-1"))
+            # only decimal points, like pd.read_csv in get_govdata_dataset
+            return csv_to_parquet(csv_path, sep=sep, decimal=".")
+    finally:
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+
+
+def get_govdata_sample(
+    link: str, n_rows: int = 10, reservoir: int = None, chunk_size: int = 65536
+) -> pd.DataFrame:
+    """
+    Retrieves a sample of a dataset from govdata without downloading the whole file.
+
+    The CSV file is read as a stream. By default only the header and the first n_rows lines are read before the
+    connection is closed. If a reservoir size is given, the whole file is streamed, but only a uniform random sample
+    of that many rows is kept in memory (reservoir sampling).
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+    n_rows : int, optional
+        The number of rows read from the beginning of the file (default is 10).
+    reservoir : int, optional
+        The size of a uniform random sample drawn from the whole file instead of its first rows (default is None).
+    chunk_size : int, optional
+        The number of bytes read from the stream at once (default is 65536).
+
+    Returns:
+    -------
+    pd.DataFrame
+        The sampled dataset as a Pandas DataFrame.
+    """
+
+    import requests
+
+    with requests.get(link, stream=True, timeout=30) as response:
+        response.raise_for_status()
+
+        if reservoir is None:
+            content = _read_head(response, n_rows + 1, chunk_size)
+        else:
+            content = _read_reservoir(response, reservoir, chunk_size)
+
+    csv_content = content.decode("iso-8859-1")
+
+    return pd.read_csv(
+        io.StringIO(csv_content),
+        sep=detect_sep(csv_content),
+        nrows=n_rows if reservoir is None else None,
+    )
+
+
+def _read_head(response: "requests.Response", num_lines: int, chunk_size: int) -> bytes:
+    """
+    Reads the first lines of a streamed response and stops the download as soon as they are complete.
+
+    Parameters:
+    ----------
+    response : requests.Response
+        The streamed response of the CSV file.
+    num_lines : int
+        The number of lines to read, including the header.
+    chunk_size : int
+        The number of bytes read from the stream at once.
+
+    Returns:
+    -------
+    bytes
+        The content of the first lines.
+    """
+
+    buffer = bytearray()
+    line_count = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer.extend(chunk)
+        line_count += chunk.count(b"\n")
+        if line_count >= num_lines:
+            # cut off the incomplete line after the last requested row
+            end = -1
+            for _ in range(num_lines):
+                end = buffer.index(b"\n", end + 1)
+            return bytes(buffer[: end + 1])
+    return bytes(buffer)
+
+
+def _read_reservoir(response: "requests.Response", size: int, chunk_size: int) -> bytes:
+    """
+    Streams the whole response and keeps the header and a uniform random sample of the remaining lines.
+
+    Parameters:
+    ----------
+    response : requests.Response
+        The streamed response of the CSV file.
+    size : int
+        The number of lines kept in the sample.
+    chunk_size : int
+        The number of bytes read from the stream at once.
+
+    Returns:
+    -------
+    bytes
+        The header and the sampled lines.
+    """
+
+    header = None
+    sample = []
+    seen = 0
+    for line in response.iter_lines(chunk_size=chunk_size):
+        if header is None:
+            header = line
+            continue
+        if not line:
+            continue
+        seen += 1
+        if len(sample) < size:
+            sample.append(line)
+        else:
+            # replace an element of the sample with probability size / seen (Algorithm R)
+            position = random.randrange(seen)
+            if position < size:
+                sample[position] = line
+
+    return b"\n".join([header or b""] + sample) + b"\n"
+
+
+def load_catalog(path: str = CATALOG_PATH) -> pd.DataFrame:
+    """
+    Loads the data catalogue from the JSON file it is stored in.
+
+    Parameters:
+    ----------
+    path : str, optional
+        The path of the JSON file (default is CATALOG_PATH).
+
+    Returns:
+    -------
+    pd.DataFrame
+        The data catalogue.
+    """
+
+    with span("catalog_load"):
+        return pd.read_json(path, encoding="iso-8859-1")
+
+
+def filter_catalog(catalog: pd.DataFrame, tag: str = None, keys: list = None) -> pd.DataFrame:
+    """
+    Filters the data catalogue by a tag and/or a list of keywords.
+
+    Parameters:
+    ----------
+    catalog : pd.DataFrame
+        The data catalogue.
+    tag : str, optional
+        The tag the datasets must have (default is None, no filtering by tag).
+    keys : list, optional
+        The keywords of which the datasets must have at least one (default is None, no filtering by keywords).
+
+    Returns:
+    -------
+    pd.DataFrame
+        The filtered data catalogue, the index of the full catalogue is kept.
+    """
+
+    with span("catalog_filter"):
+        if tag is None and keys is None:
+            return catalog
+
+        elif tag is None:
+            return catalog[
+                (catalog["Keywords"].apply(lambda x: any(elem in x for elem in keys)))
+            ]
+
+        elif keys is None:
+            return catalog[(catalog.Tag == tag)]
+
+        else:
+            return catalog[
+                (catalog["Keywords"].apply(lambda x: any(elem in x for elem in keys)))
+                & (catalog.Tag == tag)
+            ]
+
+
+def load_filtered_catalog(tag: str = None, keys: list = None) -> pd.DataFrame:
+    """
+    Loads the data catalogue filtered by a tag and/or a list of keywords.
+
+    If a snapshot of the catalogue has been published, only the matching rows are read from the memory-mapped
+    snapshot shared by all workers. Otherwise the catalogue is loaded from the JSON file and filtered.
+
+    Parameters:
+    ----------
+    tag : str, optional
+        The tag the datasets must have (default is None, no filtering by tag).
+    keys : list, optional
+        The keywords of which the datasets must have at least one (default is None, no filtering by keywords).
+
+    Returns:
+    -------
+    pd.DataFrame
+        The filtered data catalogue, the index of the full catalogue is kept.
+    """
+
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return filter_catalog(load_catalog(), tag, keys)
+
+    with span("catalog_filter"):
+        return snapshot.filter(tag, keys)
+
+
+def get_column(data, col: str) -> pd.Series:
+    """
+    Returns a column of a dataset, only this column is read if the dataset is stored in a Parquet file.
+
+    Parameters:
+    ----------
+    data : pd.DataFrame or ParquetJoinResult
+        The dataset.
+    col : str
+        The name of the column.
+
+    Returns:
+    -------
+    pd.Series
+        The column.
+    """
+
+    if isinstance(data, ParquetJoinResult):
+        return data.column(col)
+    return data[col]
+
+
+def left_join(left, right, left_on: str, right_on: str):
+    """
+    Joins the right dataset to the left dataset (left join) with the engine that fits the size of the result.
+
+    Results estimated to be smaller than JOIN_MEMORY_LIMIT are joined in memory, by the multi-threaded hash join of
+    DuckDB if the left dataset has at least THREADED_JOIN_MIN_ROWS rows and several threads are available, otherwise
+    with pandas. Larger results, and datasets stored in Parquet files
+    (results of earlier out-of-core joins and datasets too large for memory), are joined out-of-core in DuckDB and
+    stored in a Parquet file.
+
+    Parameters:
+    ----------
+    left : pd.DataFrame or ParquetJoinResult
+        The left dataset.
+    right : pd.DataFrame or ParquetJoinResult
+        The right dataset.
+    left_on : str
+        The join column of the left dataset.
+    right_on : str
+        The join column of the right dataset.
+
+    Returns:
+    -------
+    pd.DataFrame or ParquetJoinResult
+        The result of the join.
+    """
+
+    if (
+        isinstance(left, ParquetJoinResult)
+        or isinstance(right, ParquetJoinResult)
+        or estimate_join_bytes(left, right, left_on, right_on) > JOIN_MEMORY_LIMIT
+    ):
+        with span("merge_out_of_core"):
+            return duckdb_left_join(left, right, left_on, right_on)
+
+    if len(left) >= THREADED_JOIN_MIN_ROWS and JOIN_THREADS > 1:
+        with span("merge_threaded"):
+            return threaded_left_join(left, right, left_on, right_on)
+
+    with span("merge"):
+        return pd.merge(left, right, left_on=left_on, right_on=right_on, how="left")
+
+
+def join_datasets(
+    user_dataset: pd.DataFrame | ParquetJoinResult,
+    candidate_df: pd.DataFrame | ParquetJoinResult,
+    col_name_user: str,
+    col_name_catalog: str,
+) -> tuple:
+    """
+    Joins a dataset from the catalogue to the user dataset (left join).
+
+    Parameters:
+    ----------
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset.
+    candidate_df : pd.DataFrame or ParquetJoinResult
+        The dataset from the catalogue.
+    col_name_user : str
+        The column name in the user dataset for joining.
+    col_name_catalog : str
+        The column name in the catalogue dataset for joining.
+
+    Returns:
+    -------
+    tuple
+        The combined dataset (a ParquetJoinResult if it was joined out-of-core) and the list of the columns added
+        to the user dataset.
+    """
+
+    combined_df = left_join(user_dataset, candidate_df, col_name_user, col_name_catalog)
+
+    added_columns = list(combined_df.columns[len(user_dataset.columns) :])
+
+    return combined_df, added_columns
+
+
+def plan_joins(user_dataset: pd.DataFrame | ParquetJoinResult, candidates: list) -> list:
+    """
+    Orders the joins of several catalogue datasets, so the intermediate results stay as small as possible.
+
+    A left join keeps every row of the user dataset, but multiplies it by the number of matching rows in the
+    catalogue dataset. The number of result rows is estimated from the key counts of every candidate, and the joins
+    that add the fewest rows are done first.
+
+    Parameters:
+    ----------
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset.
+    candidates : list
+        A list of (solution, candidate_df) tuples, where solution is a dictionary as returned by the retriever.
+
+    Returns:
+    -------
+    list
+        The candidates in the order they should be joined.
+    """
+
+    def estimated_rows(candidate: tuple) -> float:
+        solution, candidate_df = candidate
+        try:
+            # only the join columns are read from datasets stored in Parquet files
+            key_counts = get_column(candidate_df, solution["col_name_catalog"]).value_counts()
+            matches = get_column(user_dataset, solution["col_name_user"]).map(key_counts)
+        except KeyError:
+            return float("inf")
+        return matches.fillna(1).clip(lower=1).sum()
+
+    return sorted(candidates, key=estimated_rows)
+
+
+def join_multiple_datasets(
+    user_dataset: pd.DataFrame | ParquetJoinResult, candidates: list, sources: dict
+) -> tuple:
+    """
+    Joins several datasets from the catalogue to the user dataset (left joins) in one pass.
+
+    Columns of a catalogue dataset whose names are already in the result are prefixed with the name of the source.
+
+    Parameters:
+    ----------
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset.
+    candidates : list
+        A list of (solution, candidate_df) tuples, where solution is a dictionary as returned by the retriever.
+    sources : dict
+        The names of the source datasets, keyed by the ID of the dataset in the catalogue.
+
+    Returns:
+    -------
+    tuple
+        The combined dataset (a ParquetJoinResult if it was joined out-of-core) and a dictionary mapping the name
+        of every source dataset to the list of the columns
+        added from it.
+    """
+
+    combined_df = user_dataset
+    added_columns = {}
+
+    for solution, candidate_df in plan_joins(user_dataset, candidates):
+        source = sources[solution["dataset_id"]]
+
+        # prefix overlapping columns, except the join key if it has the same name on both sides
+        renamed = {
+            col: f"{solution['dataset_id']}_{col}"
+            for col in candidate_df.columns
+            if col in combined_df.columns
+            and not (
+                col == solution["col_name_catalog"]
+                and col == solution["col_name_user"]
+            )
+        }
+        candidate_df = candidate_df.rename(columns=renamed)
+
+        joined_df = left_join(
+            combined_df,
+            candidate_df,
+            solution["col_name_user"],
+            renamed.get(solution["col_name_catalog"], solution["col_name_catalog"]),
+        )
 
-    csv_content = response.content.decode("iso-8859-1")
+        added_columns[source] = list(joined_df.columns[len(combined_df.columns) :])
+        combined_df = joined_df
 
-    return pd.read_csv(io.StringIO(csv_content), sep=detect_sep(csv_content))
+    return combined_df, added_columns
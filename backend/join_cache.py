@@ -0,0 +1,305 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+import pandas as pd
+from backend.cache import get_cache
+from backend.duckdb_join import JOIN_DIR, ParquetJoinResult, cleanup_join_dir
+from backend.tracing import record_cache
+
+# Maximum size of the cached join results, the least recently used results are evicted first
+JOIN_CACHE_SIZE = int(os.environ.get("DATAJOINER_JOIN_CACHE_SIZE_MB", 2048)) * 2**20
+
+# Options of the joins, part of the cache key so that results of other join options are not reused
+JOIN_OPTIONS = {"how": "left"}
+
+
+def hash_dataframe(df: pd.DataFrame | ParquetJoinResult) -> str:
+    """
+    Returns a hash of the content of a DataFrame, including its column names.
+
+    A dataset stored in a Parquet file is hashed by the content of the file, which is read in chunks.
+
+    Parameters:
+    ----------
+    df : pd.DataFrame or ParquetJoinResult
+        The DataFrame.
+
+    Returns:
+    -------
+    str
+        The SHA-256 hash as hexadecimal string.
+    """
+    digest = hashlib.sha256(json.dumps([str(col) for col in df.columns]).encode())
+    if isinstance(df, ParquetJoinResult):
+        with open(df.path, "rb") as file:
+            for chunk in iter(lambda: file.read(2**20), b""):
+                digest.update(chunk)
+    else:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def get_validators(link: str) -> dict:
+    """
+    Returns the HTTP validators (ETag, Last-Modified, Content-Length) of a CSV file on govdata.
+
+    They change whenever the file changes, so the content hash of a dataset can be reused without downloading it.
+
+    Parameters:
+    ----------
+    link : str
+        The link to the CSV file.
+
+    Returns:
+    -------
+    dict
+        The validators, empty if the server does not send any or cannot be reached.
+    """
+    import requests
+
+    try:
+        response = requests.head(link, allow_redirects=True, timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        return {}
+
+    return {
+        header: response.headers[header]
+        for header in ("ETag", "Last-Modified", "Content-Length")
+        if header in response.headers
+    }
+
+
+class JoinCache:
+    """
+    A class to cache the results of joins, so repeated searches with the same user dataset skip the download,
+    parsing and merge of the catalogue datasets.
+
+    The results are stored as Parquet in a size-bounded disk cache, keyed by the content hash of the user dataset,
+    the ID and content hash of every joined catalogue dataset, the join columns and the join options. Entries are
+    invalidated when the content hash of a catalogue dataset changes. The content hashes of the catalogue datasets
+    are remembered together with their HTTP validators, so an unchanged dataset is recognised without downloading it.
+
+    Attributes:
+    ----------
+    cache : diskcache.Cache
+        The disk cache with the results, evicting the least recently used results.
+    versions : diskcache.Cache
+        The disk cache with the HTTP validators and content hashes of the catalogue datasets.
+
+    Methods:
+    -------
+    content_hash(link: str, validators: dict) -> str or None
+        Returns the known content hash of a catalogue dataset if it has not changed.
+
+    record_content_hash(link: str, validators: dict, content_hash: str)
+        Remembers the content hash of a catalogue dataset.
+
+    get(user_hash: str, solutions: list, content_hashes: dict) -> tuple or None
+        Returns a cached join result.
+
+    set(user_hash: str, solutions: list, content_hashes: dict, combined_df, added_columns)
+        Stores a join result.
+    """
+
+    def __init__(self, size_limit: int = JOIN_CACHE_SIZE):
+        """
+        Opens the disk caches of the join results and of the catalogue dataset versions.
+
+        Parameters:
+        ----------
+        size_limit : int, optional
+            The maximum size of the cached join results in bytes (default is JOIN_CACHE_SIZE).
+        """
+        self.cache = get_cache(
+            "join_results",
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+        self.versions = get_cache("dataset_versions")
+
+    def content_hash(self, link: str, validators: dict) -> str:
+        """
+        Returns the known content hash of a catalogue dataset if its HTTP validators have not changed.
+
+        Parameters:
+        ----------
+        link : str
+            The link to the CSV file.
+        validators : dict
+            The current HTTP validators of the CSV file.
+
+        Returns:
+        -------
+        str or None
+            The content hash, None if the dataset has to be downloaded to determine it.
+        """
+        version = self.versions.get(link)
+        if validators and version is not None and version["validators"] == validators:
+            return version["content_hash"]
+        return None
+
+    def record_content_hash(self, link: str, validators: dict, content_hash: str):
+        """
+        Remembers the content hash of a catalogue dataset together with the HTTP validators of its CSV file.
+
+        Parameters:
+        ----------
+        link : str
+            The link to the CSV file.
+        validators : dict
+            The HTTP validators of the CSV file.
+        content_hash : str
+            The content hash of the dataset.
+        """
+        self.versions.set(link, {"validators": validators, "content_hash": content_hash})
+
+    def _keys(self, user_hash: str, solutions: list, content_hashes: dict) -> tuple:
+        """
+        Returns the key of a join result and the key of its join specification without the content hashes.
+        """
+        spec = {
+            "user": user_hash,
+            "joins": sorted(
+                [
+                    solution["dataset_id"],
+                    solution["col_name_user"],
+                    solution["col_name_catalog"],
+                ]
+                for solution in solutions
+            ),
+            "options": JOIN_OPTIONS,
+        }
+        spec_key = hashlib.sha256(json.dumps(spec).encode()).hexdigest()
+        spec["content"] = sorted(
+            [solution["dataset_id"], content_hashes[solution["dataset_id"]]]
+            for solution in solutions
+        )
+        return hashlib.sha256(json.dumps(spec).encode()).hexdigest(), spec_key
+
+    def get(self, user_hash: str, solutions: list, content_hashes: dict):
+        """
+        Returns a cached join result.
+
+        Parameters:
+        ----------
+        user_hash : str
+            The content hash of the user dataset.
+        solutions : list
+            The joined catalogue datasets, as dictionaries returned by the retriever.
+        content_hashes : dict
+            The content hashes of the catalogue datasets, keyed by their ID.
+
+        Returns:
+        -------
+        tuple or None
+            The combined dataset and the added columns, None if the result is not cached.
+        """
+        key, spec_key = self._keys(user_hash, solutions, content_hashes)
+        entry = self.cache.get(("meta", key))
+        file = self.cache.get(("data", key), read=True) if entry else None
+
+        if file is None:
+            if self.cache.get(("spec", spec_key)) not in (None, key):
+                # a catalogue dataset has changed since the result was cached
+                self._delete(self.cache.pop(("spec", spec_key)))
+            record_cache("join_result", False)
+            return None
+
+        record_cache("join_result", True)
+        with file:
+            if entry["out_of_core"]:
+                # every cached result is copied out of the cache once, later hits reuse the copy
+                cleanup_join_dir()
+                path = os.path.join(JOIN_DIR, f"cached-{key}.parquet")
+                if os.path.exists(path):
+                    os.utime(path)
+                else:
+                    os.makedirs(JOIN_DIR, exist_ok=True)
+                    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                    with open(tmp_path, "wb") as target:
+                        shutil.copyfileobj(file, target)
+                    os.replace(tmp_path, path)
+                combined_df = ParquetJoinResult(path)
+            else:
+                combined_df = pd.read_parquet(file)
+
+        return combined_df, entry["added_columns"]
+
+    def set(
+        self,
+        user_hash: str,
+        solutions: list,
+        content_hashes: dict,
+        combined_df,
+        added_columns,
+    ):
+        """
+        Stores a join result. Storing is best-effort, errors (e.g. columns that cannot be converted to Parquet) are
+        only printed, as the result has already been computed.
+
+        Parameters:
+        ----------
+        user_hash : str
+            The content hash of the user dataset.
+        solutions : list
+            The joined catalogue datasets, as dictionaries returned by the retriever.
+        content_hashes : dict
+            The content hashes of the catalogue datasets, keyed by their ID.
+        combined_df : pd.DataFrame or ParquetJoinResult
+            The combined dataset.
+        added_columns : list or dict
+            The columns added to the user dataset.
+        """
+        try:
+            self._set(user_hash, solutions, content_hashes, combined_df, added_columns)
+        except Exception as e:
+            print(f"Error caching join result: {e}")
+
+    def _set(
+        self,
+        user_hash: str,
+        solutions: list,
+        content_hashes: dict,
+        combined_df,
+        added_columns,
+    ):
+        """
+        Stores a join result, raising errors.
+        """
+        key, spec_key = self._keys(user_hash, solutions, content_hashes)
+
+        previous = self.cache.get(("spec", spec_key))
+        if previous not in (None, key):
+            self._delete(previous)
+
+        if isinstance(combined_df, ParquetJoinResult):
+            with open(combined_df.path, "rb") as file:
+                self.cache.set(("data", key), file, read=True)
+        else:
+            buffer = io.BytesIO()
+            combined_df.to_parquet(buffer, index=False)
+            buffer.seek(0)
+            self.cache.set(("data", key), buffer, read=True)
+
+        self.cache.set(
+            ("meta", key),
+            {
+                "added_columns": added_columns,
+                "out_of_core": isinstance(combined_df, ParquetJoinResult),
+            },
+        )
+        self.cache.set(("spec", spec_key), key)
+
+    def _delete(self, key: str):
+        """
+        Deletes a join result.
+        """
+        self.cache.delete(("data", key))
+        self.cache.delete(("meta", key))
+
+
+join_cache = JoinCache()
@@ -0,0 +1,150 @@
+import os
+from bisect import bisect_left
+import backend.general_methods as gm
+
+
+class KeywordIndex:
+    """
+    A class to search the keywords of the data catalogue while the user is typing.
+
+    The keywords are kept in a sorted array, so all keywords starting with the query are found by binary search.
+    If there are not enough prefix matches, keywords containing the query are looked up in a trigram index.
+    Matches are ranked by the number of datasets using the keyword.
+
+    Attributes:
+    ----------
+    counts : dict
+        The number of datasets per keyword.
+
+    Methods:
+    -------
+    search(query: str, limit: int = 20) -> list
+        Returns the best matching keywords for the query.
+    """
+
+    def __init__(self, keyword_counts: dict):
+        """
+        Builds the sorted array and the trigram index of the keywords.
+
+        Parameters:
+        ----------
+        keyword_counts : dict
+            The number of datasets per keyword.
+        """
+        self.counts = keyword_counts
+        entries = sorted((keyword.lower(), keyword) for keyword in keyword_counts)
+        self._lowered = [lowered for lowered, _ in entries]
+        self._keywords = [keyword for _, keyword in entries]
+
+        self._trigrams = {}
+        for position, lowered in enumerate(self._lowered):
+            for trigram in _trigrams(lowered):
+                self._trigrams.setdefault(trigram, set()).add(position)
+
+        self._popular = self._rank(range(len(self._keywords)))
+
+    def _rank(self, positions) -> list:
+        """
+        Returns the keywords at the given positions, the most frequent keywords first.
+        """
+        keywords = [self._keywords[position] for position in positions]
+        return sorted(keywords, key=lambda keyword: (-self.counts[keyword], keyword))
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """
+        Returns the best matching keywords for the query.
+
+        Keywords starting with the query are returned first, followed by keywords containing it.
+
+        Parameters:
+        ----------
+        query : str
+            The text typed by the user.
+        limit : int, optional
+            The maximum number of keywords returned (default is 20).
+
+        Returns:
+        -------
+        list
+            The matching keywords.
+        """
+        query = query.strip().lower() if query else ""
+        if not query:
+            return self._popular[:limit]
+
+        # all keywords with the prefix are in one contiguous range of the sorted array
+        start = bisect_left(self._lowered, query)
+        end = bisect_left(self._lowered, query + "\uffff")
+        matches = self._rank(range(start, end))[:limit]
+        if len(matches) >= limit:
+            return matches
+
+        # fall back to keywords containing the query
+        query_trigrams = _trigrams(query)
+        if query_trigrams:
+            candidates = set.intersection(
+                *(self._trigrams.get(trigram, set()) for trigram in query_trigrams)
+            )
+        else:
+            candidates = range(len(self._lowered))
+        candidates = [
+            position
+            for position in candidates
+            if not start <= position < end and query in self._lowered[position]
+        ]
+        return matches + self._rank(candidates)[: limit - len(matches)]
+
+
+def _trigrams(text: str) -> set:
+    """
+    Returns the set of the three-character substrings of a text.
+    """
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+_index = None
+_index_mtime = None
+
+
+def get_keyword_index() -> KeywordIndex:
+    """
+    Returns the keyword index of the current dropdown options, it is rebuilt after a catalogue update.
+
+    Returns:
+    -------
+    KeywordIndex
+        The keyword index.
+    """
+    global _index, _index_mtime
+
+    mtime = None
+    if os.path.exists(gm.OPTIONS_PATH):
+        mtime = os.path.getmtime(gm.OPTIONS_PATH)
+    if _index is None or mtime != _index_mtime:
+        _index = KeywordIndex(gm.load_dropdown_options()["keywords"])
+        _index_mtime = mtime
+    return _index
+
+
+def search_keywords(query: str, selected: list = None, limit: int = 20) -> list:
+    """
+    Returns the dropdown options for the keywords matching the query.
+
+    Parameters:
+    ----------
+    query : str
+        The text typed by the user.
+    selected : list, optional
+        The keywords already selected, they are always kept in the options (default is None).
+    limit : int, optional
+        The maximum number of matching keywords (default is 20).
+
+    Returns:
+    -------
+    list
+        A list of keywords, each represented as a dictionary with 'label' and 'value'.
+    """
+    selected = selected or []
+    matches = get_keyword_index().search(query, limit)
+    keywords = selected + [keyword for keyword in matches if keyword not in selected]
+    return [{"label": item, "value": item} for item in keywords]
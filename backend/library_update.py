@@ -3,6 +3,10 @@ import feedparser
 from bs4 import BeautifulSoup
 import requests
 import backend.general_methods as gm
+from backend.catalog_snapshot import publish_snapshot
+
+# Number of rows read from each CSV file to infer the column types, only the first ten are stored in the catalogue
+SAMPLE_ROWS = 1000
 
 
 def library_update():
@@ -20,8 +24,10 @@ def library_update():
     1. Fetch the latest thirty datasets from the govdata RSS feed.
     2. Extract metadata from each dataset entry.
     3. Store extracted metadata in a DataFrame.
-    4. Retrieve and clean metadata of the CSV files.
+    4. Retrieve and clean metadata of the CSV files from a sample of their first rows.
     5. Update the JSON library file with new records, removing duplicates.
+    6. Write the options of the dropdown menus for the app.
+    7. Publish a new snapshot of the catalogue shared by all workers.
 
     Returns:
     -------
@@ -82,8 +88,8 @@ def library_update():
 
     for i in range(len(df)):
         try:
-            # Retrieve the CSV dataset
-            odata = gm.get_govdata_dataset(df.loc[i, "CSV"])
+            # Retrieve a sample of the CSV dataset, the full file is not needed for the catalogue
+            odata = gm.get_govdata_sample(df.loc[i, "CSV"], n_rows=SAMPLE_ROWS)
 
         except:
             c_type_list.append("NA")
@@ -119,3 +125,9 @@ def library_update():
     full_data_ext.to_json(
         "Lib/data_library.json", default_handler=str, orient="records", indent=4
     )
+
+    # The options of the dropdown menus are precomputed, so the app does not have to parse the catalogue on startup
+    gm.write_dropdown_options(full_data_ext)
+
+    # The workers memory-map the catalogue from a snapshot, the new version is used from their next search on
+    publish_snapshot(full_data_ext)
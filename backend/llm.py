@@ -1,29 +1,34 @@
-import ollama
 import pandas as pd
 import re
+from backend.duckdb_join import ParquetJoinResult
+from backend.llm_client import llm_client
+from backend.tracing import span
 
+# Pattern of a line of the model's response, column names may contain any characters except line breaks
+# (e.g. "Tatb-Nr."), the first " - " separates the column of the user dataset from the one of the catalogue dataset
+ANSWER_PATTERN = re.compile(r"Dataset: (\d+), columns? to join: (.+?) - (.+)")
 
-def mistral_retriever(full_data: pd.DataFrame, user_dataset: pd.DataFrame) -> dict:
+# Characters the model sometimes puts around the column names
+NAME_QUOTES = " \t\"'`[]"
+
+
+def _ask_retriever(full_data: pd.DataFrame, user_dataset, system_prompt: str) -> str:
     """
-    Retrieves a matching dataset from the data catalogue and identifies join variables for integration with the user dataset.
+    Sends the first rows of the user dataset and of the first catalogue datasets to the LLM and returns its answer.
 
     Parameters:
     ----------
     full_data : pd.DataFrame
         The data catalogue containing multiple datasets.
-    user_dataset : pd.DataFrame
-        The user-provided dataset.
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset, only its first 10 rows are read.
+    system_prompt : str
+        The task of the LLM, '{data_catalog}' is replaced with the first 10 rows of the first 5 catalogue datasets.
 
     Returns:
     -------
-    dict
-        A dictionary containing the ID of the matching dataset and the join variables for both the matching and user datasets.
-        The dictionary has the following keys:
-        - 'dataset_id': The ID of the matching dataset.
-        - 'col_name_user': The column name in the user dataset for joining.
-        - 'col_name_catalog': The column name in the catalogue dataset for joining.
-
-        Returns None if no matching dataset is found.
+    str
+        The answer of the LLM.
     """
 
     # Construct a string representation of the first 10 rows of each of the first 5 datasets in the data catalogue
@@ -32,13 +37,91 @@ def mistral_retriever(full_data: pd.DataFrame, user_dataset: pd.DataFrame) -> di
 
         data_catalog += f'Dataset {index}:\n{row["top_ten_cols"]}\n\n'
 
-    user_dataset_prompt = {user_dataset.iloc[:10].to_string()}
+    if isinstance(user_dataset, ParquetJoinResult):
+        user_sample = user_dataset.page(0, 10)
+    else:
+        user_sample = user_dataset.iloc[:10]
+
     # Prepare the prompts for the chat interaction with the LLM
     # system defines the boundaries and task of the LLM, the user role prompts with the dataset
     messages = [
         {
             "role": "system",
-            "content": f"""You are an AI model working in the backend of a software tool that integrates datasets. You get the first 10 rows of a dataset from the user and the first 10 rows of a number of datasets from the data catalog. Your ONE AND ONLY TASK is to determine which single dataset from the data catalogue can be joined to the user dataset and on which column. 
+            "content": system_prompt.replace("{data_catalog}", data_catalog),
+        },
+        {
+            "role": "user",
+            "content": user_sample.to_string(),
+        },
+    ]
+
+    # The interaction is set up and executed with a MistralAI Model through ollama
+    # the client keeps the model loaded and limits the number of concurrent requests
+    with span("retriever"):
+        response = llm_client.chat(messages)
+
+    return response["message"]["content"]
+
+
+def _parse_solutions(answer: str) -> list:
+    """
+    Extracts the matching datasets and their join columns from the answer of the LLM, one per line.
+
+    Parameters:
+    ----------
+    answer : str
+        The answer of the LLM.
+
+    Returns:
+    -------
+    list
+        A list of dictionaries with the keys 'dataset_id', 'col_name_user' and 'col_name_catalog', in the order of
+        the answer. Every dataset is listed once, with the join columns of its first line.
+    """
+
+    solutions = []
+    for match in ANSWER_PATTERN.finditer(answer):
+        dataset_id = int(match.group(1))
+        if dataset_id in [solution["dataset_id"] for solution in solutions]:
+            continue
+        solutions.append(
+            {
+                "dataset_id": dataset_id,
+                "col_name_user": match.group(2).strip(NAME_QUOTES),
+                "col_name_catalog": match.group(3).strip(NAME_QUOTES),
+            }
+        )
+
+    return solutions
+
+
+def mistral_retriever(full_data: pd.DataFrame, user_dataset: pd.DataFrame | ParquetJoinResult) -> dict:
+    """
+    Retrieves a matching dataset from the data catalogue and identifies join variables for integration with the user dataset.
+
+    Parameters:
+    ----------
+    full_data : pd.DataFrame
+        The data catalogue containing multiple datasets.
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset.
+
+    Returns:
+    -------
+    dict
+        A dictionary containing the ID of the matching dataset and the join variables for both the matching and user datasets.
+        The dictionary has the following keys:
+        - 'dataset_id': The ID of the matching dataset.
+        - 'col_name_user': The column name in the user dataset for joining.
+        - 'col_name_catalog': The column name in the catalogue dataset for joining.
+
+        Returns None if no matching dataset is found.
+    """
+
+    answer = _ask_retriever(
+        full_data,
+        user_dataset,
+        """You are an AI model working in the backend of a software tool that integrates datasets. You get the first 10 rows of a dataset from the user and the first 10 rows of a number of datasets from the data catalog. Your ONE AND ONLY TASK is to determine which single dataset from the data catalogue can be joined to the user dataset and on which column. 
         
         Data Catalogue:
         {data_catalog}
@@ -50,30 +133,59 @@ def mistral_retriever(full_data: pd.DataFrame, user_dataset: pd.DataFrame) -> di
 
         DO NOT write anything beyond the ID-Number of the dataset and the name of the column as specified in the scheme above. This would be a waste of your time and precious resources. A python function takes care of the rest and just splits your string into these two parts so no one cares about anything beyond the scheme "Dataset: [ID-Number of the catalogue dataset], column to join: [column name in user ds] - [column name in catalogue dataset]"
         """,
-        },
-        {
-            "role": "user",
-            "content": f"{user_dataset_prompt}",
-        },
-    ]
+    )
 
-    # The interaction is set up and executed with a MistralAI Model through ollama
-    response = ollama.chat(model="mistral:7b-instruct-v0.3-q4_0", messages=messages)
+    solutions = _parse_solutions(answer)
 
-    # Define the regex pattern to extract the important information from the model's response
-    pattern = r"Dataset: (\d+), columns to join: (\w+) - (\w+)"
+    # If no match is found, return None, an error is created then
+    return solutions[0] if solutions else None
 
-    # Search for the pattern in the response
-    match = re.search(pattern, response["message"]["content"])
 
-    if match:
-        # If a match is found, return the extracted information as a dictionary
-        return {
-            "dataset_id": int(match.group(1)),
-            "col_name_user": match.group(2),
-            "col_name_catalog": match.group(3),
-        }
+def mistral_retriever_multi(
+    full_data: pd.DataFrame,
+    user_dataset: pd.DataFrame | ParquetJoinResult,
+    max_datasets: int = 3,
+) -> list:
+    """
+    Retrieves up to max_datasets matching datasets from the data catalogue and identifies the join variables of each
+    of them for integration with the user dataset.
 
-    else:
-        # If no match is found, return None, an error is created then
-        return None
+    Parameters:
+    ----------
+    full_data : pd.DataFrame
+        The data catalogue containing multiple datasets.
+    user_dataset : pd.DataFrame or ParquetJoinResult
+        The user-provided dataset.
+    max_datasets : int, optional
+        The maximum number of datasets retrieved (default is 3).
+
+    Returns:
+    -------
+    list
+        A list of dictionaries, best match first, with the same keys as returned by mistral_retriever:
+        - 'dataset_id': The ID of the matching dataset.
+        - 'col_name_user': The column name in the user dataset for joining.
+        - 'col_name_catalog': The column name in the catalogue dataset for joining.
+
+        The list is empty if no matching dataset is found.
+    """
+
+    answer = _ask_retriever(
+        full_data,
+        user_dataset,
+        f"""You are an AI model working in the backend of a software tool that integrates datasets. You get the first 10 rows of a dataset from the user and the first 10 rows of a number of datasets from the data catalog. Your ONE AND ONLY TASK is to determine which datasets from the data catalogue (at most {max_datasets}, best match first) can be joined to the user dataset and on which column.
+
+        Data Catalogue:
+        {{data_catalog}}
+
+        ALWAYS AND ONLY SEARCH IN THE CATALOGUE FOR MATCHING DATAFRAMES!
+        As you are in the backend and your output will be the input to a python function, so ALWAYS answer with one line per dataset according to the following scheme:
+        "Dataset: [ID-Number of the catalogue dataset], columns to join: [column name in user ds] - [column name in catalogue dataset]"
+        If you can't find a matching dataset in the catalogue, please answer with "0"
+
+        DO NOT write anything beyond the lines specified in the scheme above. A python function takes care of the rest and just splits your lines into these parts so no one cares about anything beyond the scheme "Dataset: [ID-Number of the catalogue dataset], columns to join: [column name in user ds] - [column name in catalogue dataset]"
+        """,
+    )
+
+    # every dataset is joined only once, with the join variables of its best match
+    return _parse_solutions(answer)[:max_datasets]
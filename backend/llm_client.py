@@ -0,0 +1,240 @@
+import os
+import time
+import uuid
+from backend.cache import get_cache
+from backend.tracing import registry
+
+# Model used for the retrieval and the smaller quantized model requests are routed to under load
+MODEL = os.environ.get("DATAJOINER_LLM_MODEL", "mistral:7b-instruct-v0.3-q4_0")
+FALLBACK_MODEL = os.environ.get("DATAJOINER_LLM_FALLBACK_MODEL", "mistral:7b-instruct-v0.3-q2_K")
+
+# Time Ollama keeps the models loaded after a request
+KEEP_ALIVE = os.environ.get("DATAJOINER_LLM_KEEP_ALIVE", "30m")
+
+# Maximum number of requests processed by Ollama at the same time, across all processes
+MAX_IN_FLIGHT = int(os.environ.get("DATAJOINER_LLM_MAX_IN_FLIGHT", 2))
+
+# Maximum number of waiting requests, further requests are rejected
+MAX_QUEUE = int(os.environ.get("DATAJOINER_LLM_MAX_QUEUE", 8))
+
+# Number of waiting requests from which requests are routed to the fallback model
+FALLBACK_QUEUE_DEPTH = int(os.environ.get("DATAJOINER_LLM_FALLBACK_QUEUE_DEPTH", 2))
+
+# Maximum time in seconds a request waits for a free slot, and maximum duration of a request
+QUEUE_TIMEOUT = float(os.environ.get("DATAJOINER_LLM_QUEUE_TIMEOUT", 60))
+REQUEST_TIMEOUT = float(os.environ.get("DATAJOINER_LLM_REQUEST_TIMEOUT", 300))
+
+
+class LLMOverloadedError(RuntimeError):
+    """
+    Raised if a request to the LLM is rejected because too many requests are waiting.
+    """
+
+
+class LLMClient:
+    """
+    A class to send chat requests to Ollama with admission control.
+
+    The client preloads the model, keeps it loaded between requests, and limits the number of requests processed at
+    the same time. The slots and the queue positions are expiring entries of a disk cache, so the limit holds across
+    all web workers and background jobs, and positions of killed processes are freed. Under pressure, requests are
+    routed to a smaller quantized model, and rejected if the queue is full. Queue depth, requests in flight and
+    latencies are reported as metrics.
+
+    Attributes:
+    ----------
+    host : str or None
+        The address of the Ollama server, None for the default (or the environment variable OLLAMA_HOST).
+    model : str
+        The model used for requests.
+    fallback_model : str or None
+        The model used under pressure, None to never route to another model.
+    keep_alive : str
+        The time Ollama keeps the models loaded after a request.
+    max_in_flight : int
+        The maximum number of requests processed at the same time.
+    max_queue : int
+        The maximum number of waiting requests.
+
+    Methods:
+    -------
+    warmup()
+        Loads the models into Ollama.
+
+    queue_depth() -> int
+        Returns the number of requests waiting for a free slot.
+
+    in_flight() -> int
+        Returns the number of requests being processed by Ollama.
+
+    report_metrics()
+        Sets the gauges of the queue depth and of the requests in flight.
+
+    chat(messages: list) -> dict
+        Sends a chat request.
+    """
+
+    def __init__(
+        self,
+        host: str = None,
+        model: str = MODEL,
+        fallback_model: str = FALLBACK_MODEL,
+        keep_alive: str = KEEP_ALIVE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_queue: int = MAX_QUEUE,
+    ):
+        """
+        Initializes the LLMClient, the connection to Ollama is established on first use.
+        """
+        self.host = host
+        self.model = model
+        self.fallback_model = fallback_model
+        self.keep_alive = keep_alive
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.state = get_cache("llm")
+        self._client = None
+
+    @property
+    def client(self):
+        """
+        Returns the Ollama client, ollama is imported on first use to keep the startup of the web workers fast.
+        """
+        if self._client is None:
+            import ollama
+
+            # a request must not outlive its slot, which expires after REQUEST_TIMEOUT
+            self._client = ollama.Client(host=self.host, timeout=REQUEST_TIMEOUT)
+        return self._client
+
+    def warmup(self):
+        """
+        Loads the models into Ollama, so the first request does not wait for the model to load.
+        Errors are only printed, as the application also works without the LLM.
+        """
+        for model in [self.model, self.fallback_model]:
+            if model is None:
+                continue
+            start = time.perf_counter()
+            try:
+                # a request without prompt only loads the model
+                self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            except Exception as e:
+                print(f"Error loading the model {model}: {e}")
+                continue
+            registry.observe(
+                "datajoiner_llm_warmup_seconds", time.perf_counter() - start, model=model
+            )
+
+    def _acquire(self, kind: str, size: int, expire: float):
+        """
+        Takes a free position of a queue or of the slots and returns its key and the token stored under it, None if
+        all positions are taken.
+
+        Every position is an entry of the disk cache that expires, so a position of a process that was killed
+        (e.g. a cancelled search) is freed automatically.
+        """
+        token = uuid.uuid4().hex
+        for position in range(size):
+            if self.state.add((kind, position), token, expire=expire):
+                return (kind, position), token
+        return None
+
+    def _release(self, position: tuple):
+        """
+        Frees a position taken with _acquire, unless it has expired and been taken by another request since.
+        """
+        key, token = position
+        with self.state.transact():
+            if self.state.get(key) == token:
+                self.state.delete(key)
+
+    def _count(self, kind: str, size: int) -> int:
+        """
+        Returns the number of taken positions of a queue or of the slots, expired positions are not counted.
+        """
+        return sum(self.state.get((kind, position)) is not None for position in range(size))
+
+    def queue_depth(self) -> int:
+        """
+        Returns the number of requests waiting for a free slot.
+        """
+        return self._count("waiter", self.max_queue)
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of requests being processed by Ollama.
+        """
+        return self._count("slot", self.max_in_flight)
+
+    def report_metrics(self):
+        """
+        Sets the gauges of the queue depth and of the requests in flight from the live entries.
+        """
+        registry.set_gauge("datajoiner_llm_queue_depth", self.queue_depth())
+        registry.set_gauge("datajoiner_llm_in_flight", self.in_flight())
+
+    def chat(self, messages: list) -> dict:
+        """
+        Sends a chat request, waiting for a free slot first.
+
+        Parameters:
+        ----------
+        messages : list
+            The messages of the chat.
+
+        Returns:
+        -------
+        dict
+            The response of Ollama.
+
+        Raises:
+        ------
+        LLMOverloadedError
+            If the queue is full or no slot became free within QUEUE_TIMEOUT seconds.
+        """
+        # a waiter lives at most as long as it may wait
+        waiter = self._acquire("waiter", self.max_queue, QUEUE_TIMEOUT + 5)
+        if waiter is None:
+            registry.increment("datajoiner_llm_requests_total", result="shed")
+            raise LLMOverloadedError(f"{self.max_queue} requests are waiting for the LLM")
+
+        # route to the smaller model if the queue is already long
+        model = self.model
+        if self.fallback_model is not None and self.queue_depth() > FALLBACK_QUEUE_DEPTH:
+            model = self.fallback_model
+
+        start = time.perf_counter()
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        try:
+            # slots expire as well, so a killed request cannot block a slot forever, the request itself times out
+            # before its slot expires
+            slot = self._acquire("slot", self.max_in_flight, REQUEST_TIMEOUT + 5)
+            while slot is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                slot = self._acquire("slot", self.max_in_flight, REQUEST_TIMEOUT + 5)
+        finally:
+            self._release(waiter)
+        registry.observe("datajoiner_llm_queue_wait_seconds", time.perf_counter() - start)
+
+        if slot is None:
+            registry.increment("datajoiner_llm_requests_total", result="shed")
+            raise LLMOverloadedError("No free slot for the LLM request")
+
+        start = time.perf_counter()
+        result = "error"
+        try:
+            response = self.client.chat(
+                model=model, messages=messages, keep_alive=self.keep_alive
+            )
+            result = "ok"
+            return response
+        finally:
+            self._release(slot)
+            registry.observe(
+                "datajoiner_llm_request_seconds", time.perf_counter() - start, model=model
+            )
+            registry.increment("datajoiner_llm_requests_total", result=result, model=model)
+
+
+llm_client = LLMClient(host=os.environ.get("OLLAMA_HOST"))
@@ -0,0 +1,249 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from backend.cache import get_cache
+
+try:
+    # OpenTelemetry is optional, spans are only forwarded if it is installed and configured
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
+# Upper bounds of the histogram buckets in seconds, chosen to cover everything from filtering to LLM calls
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class MetricsRegistry:
+    """
+    A class to collect latency histograms and counters of the joiner pipeline.
+
+    All values are kept as integer counters (the sums of the histograms in microseconds), so that they can be
+    incremented atomically and rendered in the Prometheus text format at any time. If a disk cache is given, the
+    counters are stored in it, so the values of all web workers and background jobs are collected in one place.
+
+    Attributes:
+    ----------
+    values : dict or diskcache.Cache
+        The counters, keyed by (kind, metric name, labels, bucket).
+
+    Methods:
+    -------
+    increment(name: str, amount: int = 1, **labels)
+        Increments a counter.
+
+    set_gauge(name: str, value: float, **labels)
+        Sets a gauge to a value.
+
+    observe(name: str, seconds: float, **labels)
+        Records a duration in a histogram.
+
+    render() -> str
+        Returns all metrics in the Prometheus text format.
+    """
+
+    def __init__(self, cache=None):
+        """
+        Initializes the MetricsRegistry with no values.
+
+        Parameters:
+        ----------
+        cache : diskcache.Cache, optional
+            A disk cache shared between processes to store the counters in (default is None, kept in memory).
+        """
+        self.values = {} if cache is None else cache
+        self._lock = Lock()
+
+    def _incr(self, key: tuple, amount: int = 1):
+        """
+        Increments the value stored under the given key.
+        """
+        if not isinstance(self.values, dict):
+            # the increment of a disk cache is atomic across processes
+            self.values.incr(key, amount, default=0)
+            return
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _items(self) -> list:
+        """
+        Returns a snapshot of all stored values.
+        """
+        if not isinstance(self.values, dict):
+            items = [(key, self.values.get(key)) for key in self.values]
+            return [(key, value) for key, value in items if value is not None]
+        with self._lock:
+            return list(self.values.items())
+
+    def increment(self, name: str, amount: int = 1, **labels):
+        """
+        Increments a counter.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the counter.
+        amount : int, optional
+            The amount to add (default is 1).
+        **labels
+            The labels of the counter.
+        """
+        self._incr(("counter", name, tuple(sorted(labels.items())), None), amount)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        Sets a gauge to a value, e.g. the current length of a queue.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the gauge.
+        value : float
+            The current value.
+        **labels
+            The labels of the gauge.
+        """
+        key = ("gauge", name, tuple(sorted(labels.items())), None)
+        if not isinstance(self.values, dict):
+            self.values.set(key, value)
+            return
+        with self._lock:
+            self.values[key] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Records a duration in a histogram.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the histogram.
+        seconds : float
+            The observed duration in seconds.
+        **labels
+            The labels of the histogram.
+        """
+        label_key = tuple(sorted(labels.items()))
+        for bucket in BUCKETS:
+            if seconds <= bucket:
+                self._incr(("histogram", name, label_key, bucket))
+        self._incr(("histogram", name, label_key, "+Inf"))
+        self._incr(("histogram_sum", name, label_key, None), int(seconds * 1e6))
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text format.
+
+        Returns:
+        -------
+        str
+            The metrics, one sample per line.
+        """
+        samples = {}
+        histograms = {}
+        for (kind, name, labels, bucket), value in sorted(self._items(), key=_sort_key):
+            metric_type = kind if kind in ("counter", "gauge") else "histogram"
+            lines = samples.setdefault((name, metric_type), [])
+
+            if kind in ("counter", "gauge"):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            else:
+                # the values of a histogram are collected first, so buckets without observations can be filled in
+                values = histograms.setdefault((name, labels), {})
+                values["sum" if kind == "histogram_sum" else bucket] = value
+
+        for (name, labels), values in histograms.items():
+            samples[(name, "histogram")].extend(_histogram_lines(name, labels, values))
+
+        output = []
+        for (name, metric_type), lines in samples.items():
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+
+def _histogram_lines(name: str, labels: tuple, values: dict) -> list:
+    """
+    Returns the samples of a histogram, including the buckets of BUCKETS without observations as 0.
+    """
+    lines = [
+        f"{name}_bucket{_format_labels(labels + (('le', str(bucket)),))} {values.get(bucket, 0)}"
+        for bucket in BUCKETS + ("+Inf",)
+    ]
+    lines.append(f"{name}_count{_format_labels(labels)} {values.get('+Inf', 0)}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {values.get('sum', 0) / 1e6}")
+    return lines
+
+
+def _format_labels(labels: tuple) -> str:
+    """
+    Formats label pairs as a Prometheus label set.
+    """
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _sort_key(item: tuple) -> tuple:
+    """
+    Orders the samples by metric, labels and ascending bucket bound.
+    """
+    (kind, name, labels, bucket), _ = item
+    bound = float("inf") if bucket in (None, "+Inf") else bucket
+    return (name, labels, kind == "histogram_sum", bound)
+
+
+registry = MetricsRegistry(get_cache("metrics"))
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Measures the duration of a stage of the joiner pipeline.
+
+    The duration is recorded in the histogram 'datajoiner_stage_duration_seconds'. If OpenTelemetry is installed,
+    an OpenTelemetry span with the same name is opened as well.
+
+    Parameters:
+    ----------
+    stage : str
+        The name of the stage, e.g. 'download' or 'merge'.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        if otel_trace is not None:
+            with otel_trace.get_tracer("datajoiner").start_as_current_span(stage):
+                yield
+        else:
+            yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        registry.observe(
+            "datajoiner_stage_duration_seconds",
+            time.perf_counter() - start,
+            stage=stage,
+            status=status,
+        )
+
+
+def record_cache(cache: str, hit: bool):
+    """
+    Counts a cache lookup in the counter 'datajoiner_cache_requests_total'.
+
+    Parameters:
+    ----------
+    cache : str
+        The name of the cache.
+    hit : bool
+        True if the lookup was a hit, otherwise False.
+    """
+    registry.increment(
+        "datajoiner_cache_requests_total", cache=cache, result="hit" if hit else "miss"
+    )
@@ -0,0 +1,236 @@
+"""
+A fake Ollama server and a check of the LLM client against it.
+
+The server answers the chat and generate endpoints of the Ollama API after a configurable delay and records the
+requests, so admission control, routing to the fallback model, load shedding and the recovery after killed requests
+can be checked without a GPU or a model:
+    python -m benchmarks.fake_ollama
+"""
+
+import json
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Answer of the fake model, in the scheme the retriever expects
+FAKE_ANSWER = "Dataset: 4, columns to join: Tatb-Nr. - Tatb-Nr."
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """
+    A local HTTP server imitating the chat and generate endpoints of Ollama.
+
+    Attributes:
+    ----------
+    delay : float
+        The time in seconds a chat request takes.
+    requests : list
+        The received requests as (path, model, keep_alive) tuples.
+    max_concurrent : int
+        The highest number of chat requests processed at the same time.
+    url : str
+        The address of the server, to be passed as host to the client.
+    """
+
+    def __init__(self, delay: float = 0.2):
+        super().__init__(("127.0.0.1", 0), _FakeOllamaHandler)
+        self.delay = delay
+        self.requests = []
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server._lock:
+            server.requests.append((self.path, body.get("model"), body.get("keep_alive")))
+
+        if self.path == "/api/chat":
+            with server._lock:
+                server._concurrent += 1
+                server.max_concurrent = max(server.max_concurrent, server._concurrent)
+            # like Ollama, the generation stops when the client closes the connection
+            cancelled = self._wait_or_disconnect(server.delay)
+            with server._lock:
+                server._concurrent -= 1
+            if cancelled:
+                return
+            answer = {"message": {"role": "assistant", "content": FAKE_ANSWER}}
+        else:
+            answer = {"response": ""}
+
+        data = json.dumps(
+            {"model": body.get("model"), "created_at": "2024-01-01T00:00:00Z", "done": True, **answer}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _wait_or_disconnect(self, seconds: float) -> bool:
+        """
+        Waits for the given time and returns True if the client closed the connection in the meantime.
+        """
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable and self.connection.recv(1, socket.MSG_PEEK) == b"":
+                return True
+        return False
+
+    def log_message(self, *args):
+        pass
+
+
+def _queued_chat(host: str):
+    """
+    Sends a chat request from a separate process, which is killed while it waits.
+    """
+    from backend.llm_client import LLMClient
+
+    LLMClient(host=host, max_in_flight=1, max_queue=2).chat([{"role": "user", "content": "x"}])
+
+
+def run_checks():
+    """
+    Runs the checks of the LLM client against the fake server and raises an AssertionError if one fails.
+    """
+    from backend.llm_client import (
+        FALLBACK_MODEL,
+        FALLBACK_QUEUE_DEPTH,
+        MODEL,
+        LLMClient,
+        LLMOverloadedError,
+    )
+
+    server = FakeOllamaServer(delay=0.3).start()
+    messages = [{"role": "user", "content": "x"}]
+
+    def chat(client):
+        try:
+            return client.chat(messages)["message"]["content"]
+        except LLMOverloadedError:
+            return None
+
+    errors = []
+
+    def slow_chat(client):
+        # requests longer than REQUEST_TIMEOUT fail with a timeout
+        try:
+            client.chat(messages)
+        except Exception as e:
+            errors.append(e)
+
+    # warmup loads both models with keep_alive
+    client = LLMClient(host=server.url, max_in_flight=1, max_queue=3)
+    client.warmup()
+    assert [r[:2] for r in server.requests] == [
+        ("/api/generate", MODEL),
+        ("/api/generate", FALLBACK_MODEL),
+    ], server.requests
+    print("warmup: ok")
+
+    # at most max_in_flight requests reach the server, the rest is queued, routed or shed
+    server.requests.clear()
+    with ThreadPoolExecutor(6) as executor:
+        answers = list(executor.map(lambda _: chat(client), range(6)))
+    models = [model for path, model, _ in server.requests if path == "/api/chat"]
+    assert server.max_concurrent == 1, server.max_concurrent
+    # the queue holds three requests, how many more are served depends on when the first ones leave it
+    assert answers.count(None) >= 1 and answers.count(FAKE_ANSWER) >= 3, answers
+    assert all(keep_alive == client.keep_alive for _, _, keep_alive in server.requests)
+    assert client.queue_depth() == 0 and client.in_flight() == 0
+    print(f"admission: ok ({answers.count(None)} shed, models {models})")
+
+    # a request joining a queue longer than FALLBACK_QUEUE_DEPTH is routed to the fallback model
+    server.requests.clear()
+    waiters = [
+        client._acquire("waiter", client.max_queue, 10) for _ in range(FALLBACK_QUEUE_DEPTH)
+    ]
+    try:
+        assert chat(client) == FAKE_ANSWER
+    finally:
+        for waiter in waiters:
+            client._release(waiter)
+    assert [model for _, model, _ in server.requests] == [FALLBACK_MODEL], server.requests
+    print("fallback routing: ok")
+
+    # positions of killed processes expire instead of blocking the queue for good
+    server.delay = 2
+    blocker = threading.Thread(
+        target=slow_chat, args=(LLMClient(host=server.url, max_in_flight=1, max_queue=2),)
+    )
+    blocker.start()
+    time.sleep(0.2)
+    process = multiprocessing.get_context("spawn").Process(
+        target=_queued_chat, args=(server.url,)
+    )
+    process.start()
+    deadline = time.monotonic() + 10
+    while client.queue_depth() == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+    assert client.queue_depth() == 1, client.queue_depth()
+    blocker.join()
+    time.sleep(float(os.environ["DATAJOINER_LLM_QUEUE_TIMEOUT"]) + 5.5)
+    assert client.queue_depth() == 0 and client.in_flight() == 0
+    print("killed request: ok (queue position expired)")
+
+    # a request running longer than REQUEST_TIMEOUT is cancelled instead of outliving its slot, and releasing it
+    # does not free the slot of another request
+    timeout = float(os.environ["DATAJOINER_LLM_REQUEST_TIMEOUT"])
+    server.delay = timeout + 1.5
+    server.max_concurrent = 0
+    slow_client = LLMClient(host=server.url, max_in_flight=1, max_queue=2)
+    errors.clear()
+    threads = [threading.Thread(target=slow_chat, args=(slow_client,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.2)
+    for thread in threads:
+        thread.join()
+    assert server.max_concurrent == 1, server.max_concurrent
+    assert len(errors) == 2 and not isinstance(errors[0], LLMOverloadedError), errors
+    assert slow_client.in_flight() == 0
+    print("request timeout: ok (slow requests cancelled, never more than one in flight)")
+
+    # a released position that was taken over by another request stays taken
+    position = client._acquire("slot", 1, 0.1)
+    time.sleep(0.2)
+    other = client._acquire("slot", 1, 10)
+    client._release(position)
+    assert client.in_flight() == 1
+    client._release(other)
+    assert client.in_flight() == 0
+    print("slot ownership: ok")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as workdir:
+        # the queue state and metrics of the check must not mix with the ones of the running application
+        os.environ["DATAJOINER_CACHE_DIR"] = workdir
+        os.environ.setdefault("DATAJOINER_LLM_QUEUE_TIMEOUT", "1")
+        os.environ.setdefault("DATAJOINER_LLM_REQUEST_TIMEOUT", "1")
+        run_checks()
@@ -0,0 +1,375 @@
+"""
+Reproducible benchmark suite of the joiner pipeline.
+
+The benchmarks generate synthetic data catalogues and user datasets shaped like the Aachen fines test case
+(test_set_joiner.csv), serve the catalogue datasets from a local HTTP server and stub the LLM, so neither network
+access nor a running Ollama instance is needed. The stages are run through the functions the application uses
+(cold start of a web worker, catalogue snapshot, load_filtered_catalog, enrich_dataset with the dataset store and
+the join cache), with the caches and snapshots in a temporary directory. For every stage the wall time and the peak of the traced memory
+allocations are reported.
+
+Run from the root of the repository:
+
+    python -m benchmarks.run_benchmarks --catalog-sizes 1000 10000 100000 --user-rows 10000 1000000 10000000
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import numpy as np
+import pandas as pd
+
+
+# Values used to generate data that looks like the test case
+INSURERS = ["Allianz", "HUK-Coburg", "AXA", "ERGO", "Generali", "DEVK", "R+V"]
+VEHICLE_TYPES = ["PKW", "SUV", "LKW", "Motorrad", "Transporter"]
+BRANDS = ["VW", "BMW", "Mercedes", "Opel", "Ford", "Toyota", "Skoda", "Audi"]
+COLOURS = ["schwarz", "weiss", "silber", "blau", "rot", "grau"]
+TAGS = [
+    "Bevölkerung und Gesellschaft",
+    "Verkehr",
+    "Bildung, Kultur und Sport",
+    "Umwelt",
+    "Regierung und öffentlicher Sektor",
+]
+
+# Response of the stubbed LLM, it always points to the first dataset of the catalogue
+STUB_ANSWER = "Dataset: 0, columns to join: Tatb-Nr. - Tatb-Nr."
+
+
+class StubClient:
+    """
+    Replaces ollama.Client, the prompt is built as usual but no model is called.
+    """
+
+    def __init__(self, host: str = None, **kwargs):
+        self.host = host
+
+    def chat(self, model: str, messages: list, **kwargs) -> dict:
+        return {"message": {"content": STUB_ANSWER}}
+
+    def generate(self, model: str, prompt: str = "", **kwargs) -> dict:
+        return {"response": ""}
+
+
+def install_llm_stub():
+    """
+    Registers a stub of the ollama package, so the retriever runs without an Ollama server.
+    """
+    sys.modules["ollama"] = types.SimpleNamespace(Client=StubClient)
+
+
+def make_offence_codes(num_codes: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns unique six-digit offence numbers (Tatb-Nr.) like the ones of the fines catalogue.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.choice(np.arange(100000, 1000000), size=num_codes, replace=False)
+
+
+def make_user_dataset(num_rows: int, codes: np.ndarray, seed: int = 1) -> pd.DataFrame:
+    """
+    Generates a user dataset with the columns of test_set_joiner.csv.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "Tatb-Nr.": rng.choice(codes, size=num_rows),
+            "Versicherung": rng.choice(INSURERS, size=num_rows),
+            "Fahrzeugtyp": rng.choice(VEHICLE_TYPES, size=num_rows),
+            "Baujahr": rng.integers(1990, 2025, size=num_rows),
+        }
+    )
+
+
+def make_catalog_dataset(codes: np.ndarray, seed: int = 2) -> pd.DataFrame:
+    """
+    Generates a catalogue dataset with the columns of the Aachen fines dataset, one row per offence number.
+    """
+    rng = np.random.default_rng(seed)
+    num_rows = len(codes)
+    days = pd.Timestamp("2021-01-01") + pd.to_timedelta(
+        rng.integers(0, 365, size=num_rows), unit="D"
+    )
+    return pd.DataFrame(
+        {
+            "Tattag": days.strftime("%d.%m.%Y"),
+            "Zeit": [
+                f"{hour:02d}:{minute:02d}"
+                for hour, minute in zip(
+                    rng.integers(0, 24, size=num_rows), rng.integers(0, 60, size=num_rows)
+                )
+            ],
+            "Fabrikat": rng.choice(BRANDS, size=num_rows),
+            "Farbe": rng.choice(COLOURS, size=num_rows),
+            "Tatort 2": [f"Straße {i}" for i in rng.integers(1, 500, size=num_rows)],
+            "Tatb-Nr.": codes,
+            "Verwarn-/Bußgeld": rng.choice(
+                [10, 15, 20, 25, 30, 35, 55, 70], size=num_rows
+            ),
+        }
+    )
+
+
+def make_catalog(num_entries: int, dataset_url: str, seed: int = 3) -> pd.DataFrame:
+    """
+    Generates a data catalogue with the schema of Lib/data_library.json, every entry points to the served dataset.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"schlagwort{i}" for i in range(max(num_entries // 5, 10))]
+    sample = make_catalog_dataset(make_offence_codes(10, seed)).to_string()
+    col_and_typ = {
+        "Tattag": "object",
+        "Zeit": "object",
+        "Fabrikat": "object",
+        "Farbe": "object",
+        "Tatort 2": "object",
+        "Tatb-Nr.": "int64",
+        "Verwarn-/Bußgeld": "int64",
+    }
+    return pd.DataFrame(
+        {
+            "Title": [f"Synthetischer Datensatz {i}" for i in range(num_entries)],
+            "Author": "Benchmark",
+            "Content": "Verwarn- und Bußgelder ruhender Verkehr " * 10,
+            "CSV": dataset_url,
+            "Tag": rng.choice(TAGS, size=num_entries),
+            "Keywords": [
+                list(rng.choice(vocabulary, size=rng.integers(1, 6), replace=False))
+                for _ in range(num_entries)
+            ],
+            "Col_and_typ": [col_and_typ] * num_entries,
+            "top_ten_cols": sample,
+        }
+    )
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves files from a directory without logging every request.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # the sampled download closes the connection after the first rows
+            pass
+
+
+def start_server(directory: str) -> http.server.ThreadingHTTPServer:
+    """
+    Starts a local HTTP server for the given directory on a free port.
+    """
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(results: list, stage: str, params: dict, func, *args, **kwargs):
+    """
+    Runs a function once, records its wall time and memory peak and returns its result.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results.append(
+        {
+            "stage": stage,
+            **params,
+            "seconds": round(seconds, 4),
+            "peak_mb": round(peak / 2**20, 2),
+        }
+    )
+    print(
+        f"{stage:<22} {json.dumps(params):<30} {seconds:>9.3f} s {peak / 2**20:>10.1f} MB"
+    )
+    return result
+
+
+def import_app():
+    """
+    Imports the application in a new interpreter, like the cold start of a web worker.
+    """
+    subprocess.run(
+        [sys.executable, "-c", "import app"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "DATAJOINER_LLM_WARMUP": "0"},
+        check=True,
+    )
+
+
+def run(catalog_sizes: list, user_rows: list, num_codes: int, workdir: str) -> list:
+    """
+    Runs all benchmarks and returns the measurements.
+    """
+    install_llm_stub()
+
+    # the caches and catalogue snapshots of the benchmarks must not mix with the ones of the application, the
+    # directories are read when the backend modules are imported
+    os.environ["DATAJOINER_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["DATAJOINER_SNAPSHOT_DIR"] = os.path.join(workdir, "snapshots")
+
+    # imported after the stub is installed and the directories are set
+    import backend.general_methods as gm
+    from backend.catalog_snapshot import get_snapshot, publish_snapshot
+    from backend.duckdb_join import ParquetJoinResult
+    from backend.enrichment import enrich_dataset
+    from backend.llm import mistral_retriever
+    from dash import dcc
+    from plotly.utils import PlotlyJSONEncoder
+
+    codes = make_offence_codes(num_codes)
+    make_catalog_dataset(codes).to_csv(
+        os.path.join(workdir, "dataset.csv"),
+        sep=";",
+        index=False,
+        encoding="iso-8859-1",
+    )
+    server = start_server(workdir)
+    dataset_url = f"http://127.0.0.1:{server.server_address[1]}/dataset.csv"
+
+    results = []
+    try:
+        measure(results, "app_startup", {}, import_app)
+
+        for num_entries in catalog_sizes:
+            params = {"catalog_entries": num_entries}
+            full_catalog = make_catalog(num_entries, dataset_url)
+            tag = full_catalog.loc[0, "Tag"]
+            keys = list(full_catalog.loc[0, "Keywords"])
+
+            measure(results, "catalog_publish", params, publish_snapshot, full_catalog)
+            del full_catalog
+            measure(results, "catalog_snapshot_map", params, get_snapshot)
+            measure(
+                results, "keyword_filter", params, gm.load_filtered_catalog, None, keys
+            )
+            catalog = measure(
+                results,
+                "tag_keyword_filter",
+                params,
+                gm.load_filtered_catalog,
+                tag,
+                keys,
+            )
+            solution = measure(
+                results,
+                "retriever_stub_llm",
+                params,
+                mistral_retriever,
+                catalog,
+                make_user_dataset(10, codes),
+            )
+
+        params = {"dataset_rows": num_codes}
+        measure(
+            results, "dataset_sample", params, gm.get_govdata_sample, dataset_url, 10
+        )
+        # the first search downloads the catalogue dataset and stores it, later searches read it from the store
+        measure(
+            results,
+            "enrich_download",
+            params,
+            enrich_dataset,
+            make_user_dataset(10, codes, seed=4),
+            [solution],
+            catalog,
+        )
+
+        for num_rows in user_rows:
+            params = {"user_rows": num_rows}
+            user_dataset = make_user_dataset(num_rows, codes)
+
+            combined_df, added_columns = measure(
+                results,
+                "enrich",
+                params,
+                enrich_dataset,
+                user_dataset,
+                [solution],
+                catalog,
+            )
+            del combined_df
+            combined_df, added_columns = measure(
+                results,
+                "enrich_cached",
+                params,
+                enrich_dataset,
+                user_dataset,
+                [solution],
+                catalog,
+            )
+            del user_dataset
+
+            def serialize_table():
+                table = gm.create_table(combined_df, highlights=added_columns)
+                return json.dumps(table, cls=PlotlyJSONEncoder)
+
+            measure(results, "table_serialization", params, serialize_table)
+            if isinstance(combined_df, ParquetJoinResult):
+                # results of out-of-core joins are exported batch by batch, like in the download callback
+                measure(
+                    results,
+                    "csv_export",
+                    params,
+                    combined_df.to_csv,
+                    os.path.join(workdir, "data_table.csv"),
+                )
+            else:
+                measure(
+                    results,
+                    "csv_export",
+                    params,
+                    dcc.send_data_frame,
+                    combined_df.to_csv,
+                    "data_table.csv",
+                )
+            del combined_df
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the joiner pipeline")
+    parser.add_argument("--catalog-sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--user-rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument(
+        "--dataset-rows",
+        type=int,
+        default=5000,
+        help="number of offence numbers in the served catalogue dataset",
+    )
+    parser.add_argument("--output", help="write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(args.catalog_sizes, args.user_rows, args.dataset_rows, workdir)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
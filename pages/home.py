@@ -4,9 +4,22 @@ import dash_bootstrap_components as dbc
 import pandas as pd
 import base64
 import io
+import os
+import uuid
 import backend.general_methods as gm
 from backend.data_manager import manager
-from backend.llm import mistral_retriever
+from backend.duckdb_join import (
+    JOIN_DIR,
+    LARGE_FILE_BYTES,
+    ParquetJoinResult,
+    csv_to_parquet,
+)
+from backend.enrichment import enrich_dataset
+from backend.keyword_index import search_keywords
+from backend.tracing import span
+
+# Maximum number of catalogue datasets joined to the user dataset in one search
+MAX_DATASETS = 3
 
 
 #####################################################################################################
@@ -14,7 +27,7 @@ from backend.llm import mistral_retriever
 # registers the page with app.py
 dash.register_page(__name__, path="/")
 # A Container component. Containers provide a means to center and horizontally pad the site’s contents.
-layout = dbc.Container(
+_layout = dbc.Container(
     [
         html.Div(
             [  # Accordion component: allows multiple sections to expand and collapse
@@ -132,7 +145,15 @@ layout = dbc.Container(
                                                                         style={
                                                                             "background-color": "#00305D"
                                                                         },
-                                                                    )
+                                                                    ),
+                                                                    # Button to cancel a running search, only enabled while searching
+                                                                    dbc.Button(
+                                                                        "Abbrechen",
+                                                                        id="cancel-button",
+                                                                        className="ms-2",
+                                                                        color="secondary",
+                                                                        disabled=True,
+                                                                    ),
                                                                 ]
                                                             )
                                                         ]
@@ -142,7 +163,9 @@ layout = dbc.Container(
                                                 dbc.Col(
                                                     html.Div(
                                                         dcc.Dropdown(
-                                                            options=gm.get_keywords(),  # Options to choose keys from
+                                                            options=search_keywords(
+                                                                ""
+                                                            ),  # Most frequent keys, further keys are searched while typing
                                                             clearable=True,
                                                             searchable=True,
                                                             placeholder="Schlüsselwörter zu ihrem Datensatzes",
@@ -153,6 +176,13 @@ layout = dbc.Container(
                                                 ),
                                             ]
                                         ),
+                                        # Progress of a running search, only visible while searching
+                                        dbc.Progress(
+                                            id="search-progress",
+                                            value=0,
+                                            className="mt-3",
+                                            style={"visibility": "hidden"},
+                                        ),
                                     ]
                                 )
                             ],
@@ -169,7 +199,7 @@ layout = dbc.Container(
                                         html.P(
                                             [
                                                 "Hier können Sie nun den integrierten Datensatz betrachten. ",
-                                                "Blau hervorgehoben sind die Spalten, mit denen ihr Datensatz aus einem offenen Datensatz angereichert wurde. ",
+                                                "Farbig hervorgehoben sind die Spalten, mit denen ihr Datensatz aus offenen Datensätzen angereichert wurde, jede Quelle in einer eigenen Farbe. ",
                                                 "Die Datentabelle ist mithilfe der Zellen unter dem Spaltentitel filterbar. ",
                                                 "Wird der Datensatz nicht vollständig dargestellt, können Sie am unteren Ende der Tabelle zur Seite scrollen",
                                                 html.Br(),
@@ -205,6 +235,20 @@ layout = dbc.Container(
     ]
 )
 
+
+def layout(**kwargs):
+    """
+    Returns the page layout with a new session id, so the data of every browser session is stored separately.
+    The id is kept in the session storage of the browser and survives reloads of the page.
+    """
+    return html.Div(
+        [
+            dcc.Store(id="session-id", data=uuid.uuid4().hex, storage_type="session"),
+            _layout,
+        ]
+    )
+
+
 ###############################################################################################
 # CALLBACKS
 ###############################################################################################
@@ -215,15 +259,18 @@ layout = dbc.Container(
     Output("accordion", "active_item", allow_duplicate=True),
     Input("dataframe-upload", "contents"),
     State("dataframe-upload", "filename"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def process_uploaded_file(contents, filename):
+def process_uploaded_file(contents, filename, session_id):
     """
     This Callback takes the uploaded file as Base64 String which should be a csv and converts it to a pd.DataFrame.
+    Files too large for memory are converted to a Parquet file instead, only its path is stored for the session.
     The Dataframe is then passed to table_and_structure(), which processes it and generates a dash DataTable
         Input:
             contents: str Base64
             filename: str Filename
+            session_id: str Id of the user session
         Output:
             data-table-import: Dash DataTable Component
             accordion: str
@@ -233,12 +280,24 @@ def process_uploaded_file(contents, filename):
         decoded = base64.b64decode(content_string)
         if filename.endswith(".csv"):
             try:
-                df = pd.read_csv(
-                    io.StringIO(decoded.decode("iso-8859-1")),
-                    delimiter=";",
-                    decimal=",",
-                    parse_dates=True,
-                )
+                if len(decoded) > LARGE_FILE_BYTES:
+                    # too large for pandas, the file is stored as Parquet and joined out-of-core
+                    os.makedirs(JOIN_DIR, exist_ok=True)
+                    csv_path = os.path.join(JOIN_DIR, f"upload-{uuid.uuid4().hex}.csv")
+                    with open(csv_path, "wb") as file:
+                        file.write(decoded)
+                    del decoded
+                    try:
+                        df = csv_to_parquet(csv_path)
+                    finally:
+                        os.remove(csv_path)
+                else:
+                    df = pd.read_csv(
+                        io.StringIO(decoded.decode("iso-8859-1")),
+                        delimiter=";",
+                        decimal=",",
+                        parse_dates=True,
+                    )
 
             except:
                 return [
@@ -256,12 +315,35 @@ def process_uploaded_file(contents, filename):
                 "upload",
             ]
 
+        manager.set_data(df, session_id)
         return gm.create_table(df), "topics_keys"
 
     else:
         raise dash.exceptions.PreventUpdate
 
 
+@callback(
+    Output("keys-dropdown", "options"),
+    Input("keys-dropdown", "search_value"),
+    State("keys-dropdown", "value"),
+)
+def update_keyword_options(search_value, value):
+    """
+    Searches the keywords of the catalogue while the user is typing and returns only the best matches as options,
+    instead of sending every keyword of the catalogue with the page layout.
+    The keywords already selected are kept in the options.
+        Input:
+            search_value: str Text typed into the keywords dropdown
+            value: list Selected keywords
+        Output:
+            keys-dropdown: list Dropdown options
+    """
+    if not search_value:
+        raise dash.exceptions.PreventUpdate
+
+    return search_keywords(search_value, value)
+
+
 @callback(
     Output("data-table-import", "children"),
     Output("download-button", "disabled"),
@@ -269,18 +351,37 @@ def process_uploaded_file(contents, filename):
     Input("search-button", "n_clicks"),
     State("tags-dropdown", "value"),
     State("keys-dropdown", "value"),
+    State("session-id", "data"),
+    background=True,
+    # the search button is disabled while a search is running, so repeated clicks do not start duplicate jobs
+    running=[
+        (Output("search-button", "disabled"), True, False),
+        (Output("cancel-button", "disabled"), False, True),
+        (
+            Output("search-progress", "style"),
+            {"visibility": "visible"},
+            {"visibility": "hidden"},
+        ),
+    ],
+    progress=[Output("search-progress", "value"), Output("search-progress", "label")],
+    cancel=[Input("cancel-button", "n_clicks")],
     prevent_initial_call=True,
 )
-def joiner(_, tag, keys):
+def joiner(set_progress, _, tag, keys, session_id):
     """
     Filter the data catalog based on user-selected tags and keywords,
     and attempt to join the user-provided dataset with a matching dataset from the catalog.
     The match is provided through the use of a Large Language Model
 
+    The search runs as a background job, so it does not block a web worker. The progress of the stages is shown
+    in a progress bar and the search can be cancelled with the cancel button.
+
     Parameters:
+        set_progress: Function to report the progress of the search as (percent, label)
         _: Placeholder for the unused parameter n_clicks
         tag: The selected tag to filter datasets in the catalog.
         keys: The selected keywords to filter datasets in the catalog.
+        session_id: The id of the user session the dataset is stored for.
 
     Returns:
         tuple: A tuple containing:
@@ -288,11 +389,11 @@ def joiner(_, tag, keys):
             - A boolean indicating whether downloading the dataframe is enabled or not (only enabled if dataframe is updated)
 
     Function logic:
-    1. Load the data catalog from the JSON file it is stored in.
+    1. Load the data catalog from the shared snapshot (or the JSON file it is stored in).
     2. Filter the catalog based on the provided tag and/or keywords.
-    3. Retrieve the user's dataset from the DataManager instance.
-    4. Use a Large Language Model to find the best matching dataset from the catalog.
-    5. Attempt to join the user dataset with the candidate dataset from the catalog.
+    3. Retrieve the user's dataset of the session from the DataManager instance.
+    4. Use a Large Language Model to find the best matching datasets (at most MAX_DATASETS) from the catalog.
+    5. Reuse a cached join result, or download the candidate datasets in parallel and join them to the user dataset in one pass.
     6. If successful, create and return a DataTable with the combined dataset and allow downloading the dataset
     7. If unsuccessful, return an error popup message.
 
@@ -301,39 +402,28 @@ def joiner(_, tag, keys):
         - Proper error handling ensures that any issues during the join process result in an informative error popup.
     """
 
-    catalog = pd.read_json("Lib/data_library.json", encoding="iso-8859-1")
-    if tag is None and keys is None:
-        pass
+    set_progress((10, "Katalog wird gefiltert"))
+    catalog = gm.load_filtered_catalog(tag, keys)
 
-    elif tag is None:
-        catalog = catalog[
-            (catalog["Keywords"].apply(lambda x: any(elem in x for elem in keys)))
-        ]
-
-    elif keys is None:
-        catalog = catalog[(catalog.Tag == tag)]
+    user_dataset = manager.get_data(session_id)
 
-    else:
-        catalog = catalog[
-            (catalog["Keywords"].apply(lambda x: any(elem in x for elem in keys)))
-            & (catalog.Tag == tag)
-        ]
-
-    user_dataset = manager.get_data()
+    set_progress((25, "Passende Datensätze werden gesucht"))
 
     # if this line is enabled, the application uses a set defition that matches the test dataset, used for, disabled in production
-    solution = {
-        "dataset_id": 4,
-        "col_name_user": "Tatb-Nr.",
-        "col_name_catalog": "Tatb-Nr.",
-    }
-
-    # if this line is enabled, the application uses the LLM, used in production, disabled for demo
-    # solution = mistral_retriever(
-    #     catalog, user_dataset
+    solutions = [
+        {
+            "dataset_id": 4,
+            "col_name_user": "Tatb-Nr.",
+            "col_name_catalog": "Tatb-Nr.",
+        }
+    ]
+
+    # if this line is enabled (with mistral_retriever_multi imported from backend.llm), the application uses the LLM, used in production, disabled for demo
+    # solutions = mistral_retriever_multi(
+    #     catalog, user_dataset, MAX_DATASETS
     # )
 
-    if solution is None:
+    if not solutions:
         # return an error message via popup
         return [
             gm.return_error_popup(
@@ -344,42 +434,75 @@ def joiner(_, tag, keys):
         ]
 
     else:
-        candidate_link = catalog.loc[solution["dataset_id"], "CSV"]
-
-        # get full dataset
-        candidate_df = gm.get_govdata_dataset(candidate_link)
-
-        # join dataset
+        # join datasets, cached results are reused and the datasets are only downloaded if necessary
         try:
-            combined_df = pd.merge(
-                user_dataset,
-                candidate_df,
-                left_on=solution["col_name_user"],
-                right_on=solution["col_name_catalog"],
-                how="left",
+            combined_df, added_columns = enrich_dataset(
+                user_dataset, solutions, catalog, set_progress
             )
 
-            added_columns = list(combined_df.columns[len(user_dataset.columns) :])
-
         except:
             # error popup
             return [
                 gm.return_error_popup(
-                    f"Leider gab es ein Problem beim Integrationsprozess. Bitte zeigen Sie den Fehler den Entwicklern an und versuchen Sie es später noch einmal. Catalog Reference: {solution['dataset_id']}"
+                    f"Leider gab es ein Problem beim Integrationsprozess. Bitte zeigen Sie den Fehler den Entwicklern an und versuchen Sie es später noch einmal. Catalog Reference: {', '.join(str(solution['dataset_id']) for solution in solutions)}"
                 ),
                 True,
                 "topics_keys",
             ]
 
-        # wrap dataset inside plotly component, allow download
-        return gm.create_table(combined_df, highlights=added_columns), False, "data"
+        set_progress((90, "Tabelle wird erstellt"))
+
+        # wrap dataset inside plotly component, highlight the columns of every source, allow download
+        with span("create_table"):
+            table = gm.create_table(combined_df, highlights=added_columns)
+        manager.set_data(combined_df, session_id)
+
+        return table, False, "data"
 
 
 @callback(
     Output("download-dataframe", "data"),
     Input("download-button", "n_clicks"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def download(_):
-    """Downloads the updated csv file"""
-    return dcc.send_data_frame(manager.get_data().to_csv, "data_table.csv")
+def download(_, session_id):
+    """Downloads the updated csv file of the session"""
+    data = manager.get_data(session_id)
+    if data is None:
+        raise dash.exceptions.PreventUpdate
+    if isinstance(data, ParquetJoinResult):
+        # results of out-of-core joins are written to the CSV file batch by batch, once per result
+        csv_path = data.path.replace(".parquet", ".csv")
+        if os.path.exists(csv_path):
+            os.utime(csv_path)
+        else:
+            data.to_csv(csv_path + ".tmp")
+            os.replace(csv_path + ".tmp", csv_path)
+        return dcc.send_file(csv_path, filename="data_table.csv")
+    return dcc.send_data_frame(data.to_csv, "data_table.csv")
+
+
+@callback(
+    Output("data-table-paged", "data"),
+    Input("data-table-paged", "page_current"),
+    State("data-table-paged", "page_size"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def load_page(page_current, page_size, session_id):
+    """
+    Loads one page of the result of an out-of-core join from its Parquet file, so the result is never sent to the
+    browser as a whole.
+        Input:
+            page_current: int Number of the requested page
+            page_size: int Rows per page
+            session_id: str Id of the user session
+        Output:
+            data-table-paged: list Rows of the page
+    """
+    data = manager.get_data(session_id)
+    if not isinstance(data, ParquetJoinResult):
+        raise dash.exceptions.PreventUpdate
+
+    return data.page(page_current, page_size).to_dict("records")